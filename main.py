@@ -1,12 +1,132 @@
-from src.extract_features import Extract
-from src.model import Model
-
-# extract = Extract()
-# extract.extract()
-# extract.build_answer()
-
-model = Model()
-model.train()
-model.test()
-# model.tpot_search()
-
+"""
+Command line entry point: python main.py {extract,answers,train,predict,search}
+Each command imports only the modules it uses, the heavy ones (xgboost, sklearn, tpot) are never
+loaded by the commands which do not need them.
+"""
+import argparse
+import sys
+import time
+
+START_TIME = time.time()
+
+from src.profiling import PROFILER
+
+
+def started(record):
+    """
+    Record the time spent between the start of the process and the first stage of the command
+    """
+    record['since_start'] = time.time() - START_TIME
+    print("Started in {:.2f}s".format(record['since_start']))
+
+
+def extract(arguments):
+    with PROFILER.stage('main.imports') as record:
+        from src.extract_features import Extract
+        from src.load_data import Load
+        started(record)
+    extract_features = Extract(Load())
+    if arguments.append:
+        for bids_path in arguments.append:
+            extract_features.append(bids_path)
+    else:
+        extract_features.extract(arguments.processes, arguments.rebuild_spec)
+
+
+def answers(arguments):
+    with PROFILER.stage('main.imports') as record:
+        from src.cache import StageCache
+        from src.extract_features import Extract
+        started(record)
+    Extract.load_answer(StageCache())
+
+
+def train(arguments):
+    with PROFILER.stage('main.imports') as record:
+        from src.model import Model
+        started(record)
+    model = Model()
+    if arguments.cv:
+        model.train_cv(n_folds=arguments.folds)
+    if arguments.streaming:
+        model.train_streaming(arguments.rounds, arguments.batch_rows, arguments.external_memory)
+    else:
+        model.train(arguments.rounds)
+    model.save_bundle()
+
+
+def predict(arguments):
+    with PROFILER.stage('main.imports') as record:
+        from src.model import Model
+        started(record)
+    model = Model()
+    try:
+        model.load_bundle(check_data_set=not arguments.any_data_set)
+    except (IOError, ValueError) as error:
+        print("{}, run 'python main.py train' first".format(error))
+        return 1
+    model.test()
+
+
+def search(arguments):
+    with PROFILER.stage('main.imports') as record:
+        from src.model import Model
+        started(record)
+    model = Model()
+    if arguments.method == 'halving':
+        model.param_search(arguments.candidates, n_processes=arguments.jobs if arguments.jobs > 0 else None)
+    else:
+        model.tpot_search(arguments.generations, arguments.population, arguments.max_time_mins, arguments.jobs)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Human or Robot pipeline")
+    parser.add_argument('--profile', action='store_true', help="sample the stack and time the per-bidder hooks")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    command = commands.add_parser('extract', help="compute the features and the data set")
+    command.add_argument('--processes', type=int, default=1, help="feature processes (0 for all cores)")
+    command.add_argument('--append', nargs='+', metavar='BIDS_CSV', help="fold new bids files instead")
+    command.add_argument('--rebuild-spec', action='store_true',
+                         help="name the legacy feature positions again in feature_spec.json (original bids only)")
+    command.set_defaults(run=extract)
+
+    command = commands.add_parser('answers', help="build the outcome of the train bidders")
+    command.set_defaults(run=answers)
+
+    command = commands.add_parser('train', help="train the model and save its bundle")
+    command.add_argument('--cv', action='store_true', help="find the boosting rounds by cross validation")
+    command.add_argument('--folds', type=int, default=5)
+    command.add_argument('--rounds', type=int, default=None, help="boosting rounds")
+    command.add_argument('--streaming', action='store_true', help="expand the train rows batch by batch")
+    command.add_argument('--batch-rows', type=int, default=65536, help="rows per batch when streaming")
+    command.add_argument('--external-memory', action='store_true',
+                         help="keep the xgboost pages on disk when streaming")
+    command.set_defaults(run=train)
+
+    command = commands.add_parser('predict', help="write result/result.csv with the saved bundle")
+    command.add_argument('--any-data-set', action='store_true',
+                         help="accept a bundle trained on another data set")
+    command.set_defaults(run=predict)
+
+    command = commands.add_parser('search', help="search the booster params or a TPOT pipeline")
+    command.add_argument('--method', choices=['tpot', 'halving'], default='tpot')
+    command.add_argument('--candidates', type=int, default=27, help="halving candidates")
+    command.add_argument('--generations', type=int, default=5)
+    command.add_argument('--population', type=int, default=50)
+    command.add_argument('--max-time-mins', type=int, default=None)
+    command.add_argument('--jobs', type=int, default=-1)
+    command.set_defaults(run=search)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    if arguments.profile:
+        PROFILER.enable(sampling=True, hooks=True)
+    if getattr(arguments, 'processes', 1) == 0:
+        arguments.processes = None
+    status = arguments.run(arguments)
+    print("Profile written to {}".format(PROFILER.write_report()))
+    sys.exit(status or 0)
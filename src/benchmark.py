@@ -0,0 +1,169 @@
+"""
+End-to-end benchmark of the pipeline stages on synthetic data
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+from src.feature_engine import FEATURE_NAMES
+from src.feature_spec import FeatureSpec
+from src.profiling import peak_rss_mb, reset_peak_rss
+from src.synthetic import SyntheticBids
+
+
+class Benchmark(object):
+    """
+    Time each stage of the pipeline, record its peak memory and compare with a stored baseline
+    """
+
+    def __init__(self, nb_rows, work_dir="bench", baseline_path="benchmark_baseline.json", tolerance=0.2,
+                 spec_path=None):
+        """
+        :param nb_rows: Number of synthetic bids
+        :param work_dir: Directory holding the synthetic data/, pickle/ and result/ folders
+        :param baseline_path: Json file of the baseline results
+        :param tolerance: Relative slow down or memory growth reported as a regression
+        :param spec_path: Feature specification to benchmark (see Benchmark.feature_spec by default)
+        """
+        self.nb_rows = nb_rows
+        self.work_dir = os.path.abspath(os.path.join(work_dir, str(nb_rows)))
+        self.baseline_path = os.path.abspath(baseline_path)
+        self.spec_path = os.path.abspath(spec_path) if spec_path else None
+        self.tolerance = tolerance
+        self.results = {}
+
+    def prepare(self):
+        """
+        Generate the synthetic data once, and remove the artifacts of the previous runs
+        """
+        if not os.path.isfile(os.path.join(self.work_dir, 'data', 'bids.csv')):
+            SyntheticBids(self.nb_rows).write(os.path.join(self.work_dir, 'data'))
+        for artifact in [os.path.join('data', 'bids_store'), 'pickle']:
+            if os.path.isdir(os.path.join(self.work_dir, artifact)):
+                shutil.rmtree(os.path.join(self.work_dir, artifact))
+        for directory in ['pickle', 'result']:
+            if not os.path.isdir(os.path.join(self.work_dir, directory)):
+                os.makedirs(os.path.join(self.work_dir, directory))
+
+    def feature_spec(self):
+        """
+        The legacy positions only describe the original bids, so the default specification is written
+        for the synthetic ones: every numeric feature, the merchandise levels and three PCA components
+        :return: FeatureSpec
+        """
+        if self.spec_path:
+            spec = FeatureSpec.load(self.spec_path)
+            if spec is None:
+                raise IOError("{} not found".format(self.spec_path))
+            return spec
+        features = [feature for feature in FEATURE_NAMES if not feature.startswith('arg_max_')]
+        features.extend('arg_max_merchandise={}'.format(level) for level in SyntheticBids(self.nb_rows).merchandises)
+        return FeatureSpec(features + ['pca_1', 'pca_2', 'pca_3'])
+
+    def measure(self, stage, function, nb_items=None):
+        """
+        Run a stage and record its wall time, peak resident memory and throughput.
+        Memory is read from the RSS high water mark: tracing allocations would slow the stage down.
+        :param stage: Stage name
+        :param function: Function running the stage
+        :param nb_items: Number of rows or bidders processed, for the throughput
+        :return: Result of function
+        """
+        reset_peak_rss()
+        start = time.time()
+        result = function()
+        seconds = time.time() - start
+
+        self.results[stage] = {
+            'seconds': seconds,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        if nb_items:
+            self.results[stage]['items_per_second'] = nb_items / max(seconds, 1e-9)
+        print("{:<22} {:>9.2f}s {:>9.1f} MB".format(stage, seconds, self.results[stage]['peak_rss_mb']))
+        return result
+
+    def run(self):
+        """
+        Run every stage in the work directory (the pipeline uses paths relative to it)
+        :return: Dict stage -> measures
+        """
+        from src.extract_features import Extract
+        from src.load_data import Load
+        from src.model import Model
+
+        self.prepare()
+        spec = self.feature_spec()
+        current_dir = os.getcwd()
+        os.chdir(self.work_dir)
+        try:
+            load_data = self.measure('Load.load_initial_data', Load, self.nb_rows)
+            extract = Extract(load_data, spec)
+            self.measure('Extract.extract', extract.extract, self.nb_rows)
+
+            self.measure('Extract.build_data_set', extract.build_data_set, len(extract.train_ids))
+            extract.build_answer()
+
+            model = Model(extract.test_data, spec)
+            self.measure('Model.train', model.train, len(model.train_answer))
+            self.measure('Model.test', model.test, len(model.test_data))
+        finally:
+            os.chdir(current_dir)
+        return self.results
+
+    def load_baseline(self):
+        if not os.path.isfile(self.baseline_path):
+            return {}
+        with open(self.baseline_path) as baseline_file:
+            return json.load(baseline_file)
+
+    def compare(self):
+        """
+        Compare the results with the baseline of the same size
+        :return: List of regression messages
+        """
+        baseline = self.load_baseline().get(str(self.nb_rows), {})
+        regressions = []
+        for stage, measures in self.results.items():
+            if stage not in baseline:
+                continue
+            for measure in ['seconds', 'peak_rss_mb']:
+                if measure not in baseline[stage]:
+                    continue
+                reference = baseline[stage][measure]
+                if measures[measure] > reference * (1 + self.tolerance):
+                    regressions.append("{} {}: {:.2f} (baseline {:.2f})".format(stage, measure, measures[measure],
+                                                                                reference))
+        return regressions
+
+    def save_baseline(self):
+        baseline = self.load_baseline()
+        baseline[str(self.nb_rows)] = self.results
+        with open(self.baseline_path, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic bids")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000], help="sizes to benchmark")
+    parser.add_argument('--work-dir', default="bench")
+    parser.add_argument('--baseline', default="benchmark_baseline.json")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--spec', default=None, help="feature_spec.json to benchmark (synthetic spec by default)")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the baseline")
+    arguments = parser.parse_args()
+
+    failed = False
+    for nb_rows in arguments.rows:
+        print("Benchmark with {} bids".format(nb_rows))
+        benchmark = Benchmark(nb_rows, arguments.work_dir, arguments.baseline, arguments.tolerance, arguments.spec)
+        benchmark.run()
+        if arguments.save_baseline:
+            benchmark.save_baseline()
+        for regression in benchmark.compare():
+            failed = True
+            print("REGRESSION " + regression)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,136 @@
+"""
+Content-addressed cache of the pipeline stages
+"""
+import gzip
+import hashlib
+import inspect
+import os
+import pickle
+
+from src.profiling import PROFILER
+
+
+class StageCache(object):
+    """
+    Store the result of each stage under a key made of the hash of its input files,
+    the version of its code and its parameters
+    """
+
+    def __init__(self, path="pickle/cache", compress_level=3):
+        """
+        :param path: Cache directory
+        :param compress_level: gzip level of the entries (0 to store them uncompressed)
+        """
+        self.path = path
+        self.compress_level = compress_level
+        self.file_hashes_path = os.path.join(self.path, 'file_hashes.pkl')
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    @staticmethod
+    def code_version(*objects):
+        """
+        Hash of the source code of functions, classes or modules
+        """
+        sha = hashlib.sha1()
+        for code_object in objects:
+            sha.update(inspect.getsource(code_object).encode('utf-8'))
+        return sha.hexdigest()
+
+    @staticmethod
+    def atomic_dump(file_name, object_to_dump, compress_level=0):
+        """
+        Pickle an object to a temporary file then rename it, so a crash never leaves a partial entry
+        """
+        tmp_name = '{}.{}.tmp'.format(file_name, os.getpid())
+        if compress_level:
+            data_file = gzip.open(tmp_name, 'wb', compresslevel=compress_level)
+        else:
+            data_file = open(tmp_name, 'wb')
+        with data_file:
+            pickle.dump(object_to_dump, data_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_name, file_name)
+
+    def file_hash(self, file_name):
+        """
+        Sha1 of a file content, recomputed only when its size or modification time changes
+        """
+        file_hashes = {}
+        if os.path.isfile(self.file_hashes_path):
+            with open(self.file_hashes_path, 'rb') as data_file:
+                file_hashes = pickle.load(data_file)
+
+        status = os.stat(file_name)
+        signature = (status.st_size, status.st_mtime)
+        name = os.path.abspath(file_name)
+        if name in file_hashes and file_hashes[name][0] == signature:
+            return file_hashes[name][1]
+
+        sha = hashlib.sha1()
+        with open(file_name, 'rb') as data_file:
+            for block in iter(lambda: data_file.read(1024 ** 2), b''):
+                sha.update(block)
+        file_hashes[name] = (signature, sha.hexdigest())
+        self.atomic_dump(self.file_hashes_path, file_hashes)
+        return sha.hexdigest()
+
+    def key(self, stage, version, inputs=(), params=None, upstream=()):
+        """
+        Key of a stage result
+        :param stage: Stage name
+        :param version: Version of the stage code (see code_version)
+        :param inputs: Input files of the stage
+        :param params: Parameters of the stage
+        :param upstream: Keys of the stages it depends on
+        """
+        sha = hashlib.sha1()
+        sha.update(stage.encode('utf-8'))
+        sha.update(version.encode('utf-8'))
+        for file_name in inputs:
+            sha.update(self.file_hash(file_name).encode('utf-8'))
+        sha.update(repr(sorted((params or {}).items())).encode('utf-8'))
+        for upstream_key in upstream:
+            sha.update(upstream_key.encode('utf-8'))
+        return '{}-{}'.format(stage, sha.hexdigest())
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + ('.pkl.gz' if self.compress_level else '.pkl'))
+
+    def has(self, key):
+        return os.path.isfile(self.entry_path(key))
+
+    def get(self, key):
+        """
+        Load a stage result
+        :param key: Stage key
+        """
+        self.hits += 1
+        file_name = self.entry_path(key)
+        data_file = gzip.open(file_name, 'rb') if file_name.endswith('.gz') else open(file_name, 'rb')
+        with data_file:
+            data = pickle.load(data_file)
+        return data
+
+    def put(self, key, object_to_dump):
+        """
+        Store a stage result
+        :param key: Stage key
+        :param object_to_dump: Stage result
+        """
+        self.misses += 1
+        self.atomic_dump(self.entry_path(key), object_to_dump, self.compress_level)
+        return object_to_dump
+
+    def get_or_compute(self, key, compute):
+        """
+        Load a stage result or compute and store it
+        :param key: Stage key
+        :param compute: Function computing the result
+        """
+        if self.has(key):
+            PROFILER.increment('cache_hits')
+            return self.get(key)
+        PROFILER.increment('cache_misses')
+        return self.put(key, compute())
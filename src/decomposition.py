@@ -0,0 +1,67 @@
+"""
+Dimensionality reduction on sparse data
+"""
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, svds
+from sklearn.utils.extmath import svd_flip
+
+
+class SparseInputPCA(object):
+    """
+    PCA accepting a scipy sparse matrix: the data is centered implicitly inside a LinearOperator,
+    so the centered (dense) matrix is never built
+    """
+
+    def __init__(self, n_components=3, random_state=None):
+        self.n_components = n_components
+        self.random_state = random_state
+        self.mean_ = None
+        self.components_ = None
+        self.explained_variance_ = None
+        self.singular_values_ = None
+
+    def fit(self, data, answer=None):
+        """
+        Fit the principal axes
+        :param data: Sparse (or dense) matrix
+        :param answer: Ignored, kept for the PCA interface
+        """
+        data = sparse.csr_matrix(data, dtype=np.float64)
+        n_rows, n_columns = data.shape
+        self.mean_ = np.asarray(data.mean(axis=0)).ravel()
+        data_t = data.T.tocsr()
+
+        def matvec(vector):
+            vector = np.ravel(vector)
+            return data.dot(vector) - self.mean_.dot(vector)
+
+        def rmatvec(vector):
+            vector = np.ravel(vector)
+            return data_t.dot(vector) - self.mean_ * vector.sum()
+
+        centered = LinearOperator((n_rows, n_columns), matvec=matvec, rmatvec=rmatvec, dtype=np.float64)
+        v0 = np.random.RandomState(self.random_state).uniform(-1, 1, min(n_rows, n_columns))
+        u, s, vt = svds(centered, k=self.n_components, v0=v0)
+
+        # svds returns the singular values in increasing order
+        order = np.argsort(s)[::-1]
+        u, s, vt = u[:, order], s[order], vt[order]
+        u, vt = svd_flip(u, vt)
+
+        self.components_ = vt
+        self.singular_values_ = s
+        self.explained_variance_ = s ** 2 / max(n_rows - 1, 1)
+        return self
+
+    def transform(self, data):
+        """
+        Project data on the principal axes
+        :param data: Sparse (or dense) matrix
+        :return: Dense array (n_rows, n_components)
+        """
+        projection = np.asarray(data.dot(self.components_.T))
+        return projection - self.mean_.dot(self.components_.T)
+
+    def fit_transform(self, data, answer=None):
+        return self.fit(data, answer).transform(data)
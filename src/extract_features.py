@@ -1,25 +1,63 @@
 """
 Extract features from initial data
 """
-import os
+import multiprocessing
 import pickle
+import time
 import numpy as np
 import pandas as pd
-from sklearn.preprocessing import StandardScaler, LabelBinarizer
-from sklearn_pandas import DataFrameMapper
-
-from src.load_data import Load
+from scipy import sparse
+
+from src import feature_engine, feature_spec, incremental, load_data
+from src.cache import StageCache
+from src.feature_engine import FeatureEngine, AUCTION_CONTEXT_COLUMNS, CATEGORY_COLUMNS, COLUMN_NAMES
+from src.feature_spec import FeatureEncoder, FeatureSpec
+from src.incremental import IncrementalFeatures
+from src.load_data import BidStore, Load
+from src.profiling import PROFILER
+
+
+# Bid stores opened by a worker process, kept across its shards
+WORKER_STORES = {}
+
+
+def extract_shard(shard):
+    """
+    Compute the features of a contiguous range of bidders of the bid store (run in a worker process)
+    :param shard: (store path, first bidder code, last bidder code, features to compute)
+    :return: train_ids, train
+    """
+    store_path, first_bidder, last_bidder, columns = shard
+    if store_path not in WORKER_STORES:
+        WORKER_STORES[store_path] = BidStore(store_path)
+    store = WORKER_STORES[store_path]
+    encoded_bids = store.bidder_range_bids(first_bidder, last_bidder)
+    categories = {column: encoded_bids.codes[column] for column in CATEGORY_COLUMNS}
+    category_uniques = {column: encoded_bids.dictionaries[column] for column in CATEGORY_COLUMNS}
+    engine = FeatureEngine(encoded_bids.codes['bidder_id'] - first_bidder, encoded_bids.time, categories,
+                           encoded_bids.dictionaries['bidder_id'][first_bidder:last_bidder], category_uniques,
+                           encoded_bids.file_rows)
+    return engine.compute(columns)
 
 
 class Extract(object):
 
-    def __init__(self):
-        self.load_data = Load()
+    def __init__(self, load_data=None, spec=None):
+        """
+        :param load_data: Already loaded data (loaded here by default)
+        :type load_data: Load
+        :param spec: Feature specification (read from FEATURE_SPEC_PATH by default, built from the legacy
+        positions by Extract.extract if the file does not exist)
+        :type spec: FeatureSpec
+        """
+        self.load_data = load_data or Load()
+        self.cache = StageCache()
+        self.spec = spec or FeatureSpec.load()
         self.train_ids = []
         self.train = []
         self.train_data_set = None
         self.train_answer = pd.DataFrame()
-        self.test_data = [test_id for test_id in pd.read_csv("data/test.csv", sep=',')['bidder_id']]
+        self.test_data = list(self.load_data.test['bidder_id'])
 
     @staticmethod
     def load(pickle_name):
@@ -38,21 +76,26 @@ class Extract(object):
         Normalise continuous data and binarize categorical data
         :param data: Compute data
         :type data: Pandas Dataframe
+        :return: CSR matrix, fitted mapper
         """
+        # Only needed to build the feature specification, imported here to keep the other stages fast to start
+        from sklearn.preprocessing import StandardScaler, LabelBinarizer
+        from sklearn_pandas import DataFrameMapper
+
         types = data.dtypes
         mapper_arg = []
         for col, colType in types.iteritems():
             if colType.name == 'float64' or colType.name == 'int64':
                 mapper_arg.append(([col], StandardScaler()))
             else:
-                mapper_arg.append(('{}'.format(col), LabelBinarizer()))
-        mapper = DataFrameMapper(mapper_arg)
-        print(mapper)
-        data = mapper.fit_transform(data)
+                mapper_arg.append(('{}'.format(col), LabelBinarizer(sparse_output=True)))
+        mapper = DataFrameMapper(mapper_arg, sparse=True)
+        data = sparse.csr_matrix(mapper.fit_transform(data))
 
-        return data
+        return data, mapper
 
     @staticmethod
+    @PROFILER.hook
     def compute_stats_by_categories(series):
         """
         Compute classic statistical analysis on series
@@ -70,6 +113,7 @@ class Extract(object):
         return nb_unique, low_freq, high_freq, std_freq, arg_max
 
     @staticmethod
+    @PROFILER.hook
     def compute_stats_for_time_series(series):
         """
         Compute classic statistical analysis on time interval between bids
@@ -98,6 +142,7 @@ class Extract(object):
         return bid_nb, min_time, max_time, range_time, min_time_interval, max_time_interval, mean_time_interval, \
                std_time_interval, time_interval_25, time_interval_50, time_interval_75
 
+    @PROFILER.hook
     def compute_stats_for_time_series_with_group_by(self, table, column, group_by):
         """
         Compute classic statistical analysis on time interval between bids during an auction
@@ -148,119 +193,372 @@ class Extract(object):
                mean_auction_max_time_interval, mean_auction_mean_time_interval, std_auction_mean_time_interval, \
                mean_auction_std_time_interval
 
-    def extract(self):
+    def compute_features_by_bidder(self, bids):
         """
-        Extract features from initial data
-        :return: train_ids.pkl, train.pkl, train_data_set.pkl
+        Compute the features bidder by bidder (reference implementation of the FeatureEngine)
+        :param bids: Bids data
+        :type bids: Pandas Dataframe
+        :return: train_ids, train
+        """
+        train_ids = []
+        train = []
+        for bidder_id, group in bids.groupby('bidder_id'):
+            nb_unique_ip, low_freq_ip, high_freq_ip, std_freq_ip, arg_max_ip = \
+                self.compute_stats_by_categories(group.ip)
+            nb_unique_device, low_freq_device, high_freq_device, std_freq_device, arg_max_device = \
+                self.compute_stats_by_categories(group.device)
+            nb_unique_merchandise, low_freq_merchandise, high_freq_merchandise, std_freq_merchandise, \
+            arg_max_merchandise = self.compute_stats_by_categories(group.merchandise)
+            nb_unique_country, low_freq_country, high_freq_country, std_freq_country, arg_max_country = \
+                self.compute_stats_by_categories(group.country)
+            nb_unique_url, low_freq_url, high_freq_url, std_freq_url, arg_max_url = \
+                self.compute_stats_by_categories(group.url)
+            nb_unique_auction, low_freq_auction, high_freq_auction, std_freq_auction, arg_max_auction = \
+                self.compute_stats_by_categories(group.auction)
+
+            bid_nb, min_time, max_time, range_time, min_time_interval, max_time_interval, mean_time_interval, \
+            std_time_interval, time_interval_25, time_interval_50, time_interval_75, mean_of_auction_bid_nb, \
+            std_of_auction_bid_nb, mean_of_auction_range_time, std_of_auction_range_time, \
+            min_of_auction_min_time_interval, mean_of_auction_min_time_interval, max_auction_max_time_interval, \
+            mean_auction_max_time_interval, mean_auction_mean_time_interval, std_auction_mean_time_interval, \
+            mean_auction_std_time_interval = \
+            self.compute_stats_for_time_series_with_group_by(group, 'time', 'auction')
+
+            statistical_results = [
+                nb_unique_ip, low_freq_ip, high_freq_ip, std_freq_ip, arg_max_ip,
+                nb_unique_device, low_freq_device, high_freq_device, std_freq_device, arg_max_device,
+                nb_unique_merchandise, low_freq_merchandise, high_freq_merchandise, std_freq_merchandise,
+                arg_max_merchandise,
+                nb_unique_country, low_freq_country, high_freq_country, std_freq_country, arg_max_country,
+                nb_unique_url, low_freq_url, high_freq_url, std_freq_url, arg_max_url,
+                nb_unique_auction, low_freq_auction, high_freq_auction, std_freq_auction, arg_max_auction,
+                bid_nb, min_time, max_time, range_time, min_time_interval, max_time_interval, mean_time_interval,
+                std_time_interval, time_interval_25, time_interval_50, time_interval_75, mean_of_auction_bid_nb,
+                std_of_auction_bid_nb, mean_of_auction_range_time, std_of_auction_range_time,
+                min_of_auction_min_time_interval, mean_of_auction_min_time_interval, max_auction_max_time_interval,
+                mean_auction_max_time_interval, mean_auction_mean_time_interval, std_auction_mean_time_interval,
+                mean_auction_std_time_interval
+
+            ]
+
+            train_ids.append(bidder_id)
+            train.append(statistical_results)
+        return train_ids, train
+
+    @staticmethod
+    def arg_max_ties(bids, bidder_ids, column, loop_values, engine_values):
         """
-        if not os.path.isfile('pickle/train_ids.pkl'):
-            print("Extract IDs")
-            for bidder_id, group in self.load_data.bids.groupby('bidder_id'):
-                self.train_ids.append(bidder_id)
-            self.dump('pickle/train_ids.pkl', self.train_ids)
+        Tell which arg_max differences are ties: the per-bidder loop takes the first value of value_counts,
+        whose order among equal counts is not defined, the FeatureEngine the first value seen in the bids
+        of the bidder
+        :param bids: Bids dataframe the features were computed on
+        :param bidder_ids: Bidder of each difference
+        :param column: Categorical column name
+        :param loop_values: arg_max of the loop
+        :param engine_values: arg_max of the FeatureEngine
+        :return: Boolean array, True where both values are among the most frequent ones of the bidder
+        """
+        counts = bids.groupby(['bidder_id', column]).size()
+        ties = []
+        for bidder_id, loop_value, engine_value in zip(bidder_ids, loop_values, engine_values):
+            bidder_counts = counts[bidder_id]
+            bidder_counts.index = bidder_counts.index.astype(str)
+            high_count = bidder_counts.max()
+            ties.append(bidder_counts.get(loop_value) == high_count and bidder_counts.get(engine_value) == high_count)
+        return np.array(ties, dtype=bool)
+
+    def check_feature_engine(self, nb_bidders=200):
+        """
+        Check the FeatureEngine against the per-bidder loop on a sample of bidders
+        :param nb_bidders: Number of bidders to compare (None for all of them)
+        :return: Dict column name -> number of bidders with a different value (raises if any)
+        """
+        encoded_bids = self.load_data.encoded_bids
+        bidder_codes = encoded_bids.codes['bidder_id']
+        if nb_bidders is None:
+            bids = encoded_bids.to_frame()
         else:
-            print("IDs already created")
-            # print("Load IDs")
-            # with open('pickle/train_ids.pkl', 'rb') as train_ids_file:
-            # self.train_ids = pickle.load(train_ids_file)
-
-        if not os.path.isfile('pickle/train.pkl'):
-            print("Extract features")
-            for bidder_id, group in self.load_data.bids.groupby('bidder_id'):
-                print(bidder_id)
-                nb_unique_ip, low_freq_ip, high_freq_ip, std_freq_ip, arg_max_ip = \
-                    self.compute_stats_by_categories(group.ip)
-                nb_unique_device, low_freq_device, high_freq_device, std_freq_device, arg_max_device = \
-                    self.compute_stats_by_categories(group.device)
-                nb_unique_merchandise, low_freq_merchandise, high_freq_merchandise, std_freq_merchandise, \
-                arg_max_merchandise = self.compute_stats_by_categories(group.merchandise)
-                nb_unique_country, low_freq_country, high_freq_country, std_freq_country, arg_max_country = \
-                    self.compute_stats_by_categories(group.country)
-                nb_unique_url, low_freq_url, high_freq_url, std_freq_url, arg_max_url = \
-                    self.compute_stats_by_categories(group.url)
-                nb_unique_auction, low_freq_auction, high_freq_auction, std_freq_auction, arg_max_auction = \
-                    self.compute_stats_by_categories(group.auction)
-
-                bid_nb, min_time, max_time, range_time, min_time_interval, max_time_interval, mean_time_interval, \
-                std_time_interval, time_interval_25, time_interval_50, time_interval_75, mean_of_auction_bid_nb, \
-                std_of_auction_bid_nb, mean_of_auction_range_time, std_of_auction_range_time, \
-                min_of_auction_min_time_interval, mean_of_auction_min_time_interval, max_auction_max_time_interval, \
-                mean_auction_max_time_interval, mean_auction_mean_time_interval, std_auction_mean_time_interval, \
-                mean_auction_std_time_interval = \
-                self.compute_stats_for_time_series_with_group_by(group, 'time', 'auction')
-
-                statistical_results = [
-                    nb_unique_ip, low_freq_ip, high_freq_ip, std_freq_ip, arg_max_ip,
-                    nb_unique_device, low_freq_device, high_freq_device, std_freq_device, arg_max_device,
-                    nb_unique_merchandise, low_freq_merchandise, high_freq_merchandise, std_freq_merchandise,
-                    arg_max_merchandise,
-                    nb_unique_country, low_freq_country, high_freq_country, std_freq_country, arg_max_country,
-                    nb_unique_url, low_freq_url, high_freq_url, std_freq_url, arg_max_url,
-                    nb_unique_auction, low_freq_auction, high_freq_auction, std_freq_auction, arg_max_auction,
-                    bid_nb, min_time, max_time, range_time, min_time_interval, max_time_interval, mean_time_interval,
-                    std_time_interval, time_interval_25, time_interval_50, time_interval_75, mean_of_auction_bid_nb,
-                    std_of_auction_bid_nb, mean_of_auction_range_time, std_of_auction_range_time,
-                    min_of_auction_min_time_interval, mean_of_auction_min_time_interval, max_auction_max_time_interval,
-                    mean_auction_max_time_interval, mean_auction_mean_time_interval, std_auction_mean_time_interval,
-                    mean_auction_std_time_interval
-
-                ]
-
-                self.train.append(statistical_results)
-            self.dump('pickle/train.pkl', self.train)
+            nb_codes = len(encoded_bids.dictionaries['bidder_id'])
+            sample = np.random.RandomState(420).permutation(nb_codes)[:nb_bidders]
+            bids = encoded_bids.to_frame(np.flatnonzero(np.isin(bidder_codes, sample)))
+
+        start = time.time()
+        loop_ids, loop_train = self.compute_features_by_bidder(bids)
+        loop_time = time.time() - start
+
+        start = time.time()
+        engine_ids, engine_train = FeatureEngine.from_frame(bids).compute()
+        engine_time = time.time() - start
+
+        assert list(loop_ids) == list(engine_ids), "Bidder ids differ"
+        loop_data = pd.DataFrame(loop_train, columns=COLUMN_NAMES)
+        engine_data = pd.DataFrame(engine_train, columns=COLUMN_NAMES)
+
+        mismatches = {}
+        ties = {}
+        for column in COLUMN_NAMES:
+            if column.startswith('arg_max'):
+                different = (loop_data[column] != engine_data[column]).values
+                tie = np.zeros(len(different), dtype=bool)
+                tie[different] = self.arg_max_ties(bids, np.asarray(loop_ids)[different], column[len('arg_max_'):],
+                                                   loop_data[column].values[different],
+                                                   engine_data[column].values[different])
+                ties[column] = int(tie.sum())
+                different &= ~tie
+            else:
+                different = ~np.isclose(loop_data[column].values, engine_data[column].values, rtol=1e-9,
+                                        equal_nan=True)
+            mismatches[column] = int(different.sum())
+
+        print("Loop: {:.2f}s, engine: {:.2f}s ({:.1f}x)".format(loop_time, engine_time,
+                                                                  loop_time / max(engine_time, 1e-9)))
+        print("arg_max ties broken differently: {}".format({column: count for column, count in ties.items()
+                                                            if count}))
+        different_columns = {column: count for column, count in mismatches.items() if count}
+        if different_columns:
+            raise AssertionError("FeatureEngine differs from the per-bidder loop: {}".format(different_columns))
+        return mismatches
+
+    @staticmethod
+    def stage_keys(cache, bids_path="data/bids.csv", train_path="data/train.csv", appended_hashes=None, spec=None):
+        """
+        Cache keys of the extraction stages
+        :param cache: Stage cache
+        :type cache: StageCache
+        :param appended_hashes: Content hashes of the bids files folded by Extract.append, as recorded when they
+        were folded (read from the summaries manifest by default, the files themselves are not read again)
+        :param spec: Feature specification (read from FEATURE_SPEC_PATH by default, all the features if missing)
+        :return: Dict stage name -> key
+        """
+        spec = spec or FeatureSpec.load()
+        if appended_hashes is None:
+            appended_hashes = IncrementalFeatures.appended_hashes(cache.file_hash(bids_path))
+        params = {'columns': spec.raw_columns()} if spec else {}
+        if appended_hashes:
+            version = cache.code_version(feature_engine, load_data, incremental)
+            params['appended'] = list(appended_hashes)
         else:
-            print("Train already created")
-            # print("Load features")
-            # with open('pickle/train.pkl', 'rb') as train_file:
-            # self.train = pickle.load(train_file)
-
-        if not os.path.isfile('pickle/train_data_set.pkl'):
-            print("Building data set with the features")
-            column_names = [
-                'nb_unique_ip', 'low_freq_ip', 'high_freq_ip', 'std_freq_ip', 'arg_max_ip',
-                'nb_unique_device', 'low_freq_device', 'high_freq_device', 'std_freq_device', 'arg_max_device',
-                'nb_unique_merchandise', 'low_freq_merchandise', 'high_freq_merchandise', 'std_freq_merchandise',
-                'arg_max_merchandise',
-                'nb_unique_country', 'low_freq_country', 'high_freq_country', 'std_freq_country', 'arg_max_country',
-                'nb_unique_url', 'low_freq_url', 'high_freq_url', 'std_freq_url', 'arg_max_url',
-                'nb_unique_auction', 'low_freq_auction', 'high_freq_auction', 'std_freq_auction', 'arg_max_auction',
-                "bid_nb", "min_time", "max_time", "range_time", "min_time_interval", "max_time_interval",
-                "mean_time_interval", "std_time_interval", "time_interval_25", "time_interval_50", "time_interval_75",
-                "mean_of_auction_bid_nb", "std_of_auction_bid_nb", "mean_of_auction_range_time",
-                "std_of_auction_range_time", "min_of_auction_min_time_interval", "mean_of_auction_min_time_interval",
-                "max_auction_max_time_interval", "mean_auction_max_time_interval", "mean_auction_mean_time_interval",
-                "std_auction_mean_time_interval", "mean_auction_std_time_interval"
-            ]
+            version = cache.code_version(feature_engine, load_data)
+        features = cache.key('features', version, inputs=[bids_path], params=params)
+        data_set = cache.key('data_set', cache.code_version(Extract.build_data_set, feature_spec),
+                             params={'features': spec.features} if spec else None, upstream=[features])
+        return {'features': features, 'data_set': data_set, 'answer': Extract.answer_key(cache, train_path)}
 
-            self.train_ids = self.load('pickle/train_ids.pkl')
-            self.train = self.load('pickle/train.pkl')
+    @staticmethod
+    def answer_key(cache, train_path="data/train.csv"):
+        """
+        Cache key of the answer stage, which only depends on train.csv
+        :param cache: Stage cache
+        :type cache: StageCache
+        """
+        return cache.key('answer', cache.code_version(Extract.compute_answer), inputs=[train_path])
 
-            data_set = pd.DataFrame(self.train, index=self.train_ids, columns=column_names)
-            data_set.fillna(0.0, inplace=True)
+    def build_data_set(self):
+        """
+        Build the normalised data set of the specified features
+        :return: Dict with the bidder ids, the sparse data set and the fitted encoder
+        """
+        data_set = pd.DataFrame(self.train, index=self.train_ids, columns=self.spec.raw_columns())
+        data_set.fillna(0.0, inplace=True)
 
-            data_set = self.return_cleaned_data(data_set)
+        encoder = FeatureEncoder(self.spec)
+        return {'ids': list(self.train_ids), 'matrix': encoder.fit_transform(data_set), 'mapper': encoder}
 
-            data_set = pd.DataFrame(data_set, index=self.train_ids)
-            data_set.fillna(0.0, inplace=True)
+    def build_feature_spec(self, nb_processes=1):
+        """
+        Name the LEGACY_POSITIONS with the full binarized data set of the original bids and save them
+        (raises ValueError on any other bids, whose layout the positions do not describe)
+        :return: FeatureSpec
+        """
+        keys = self.stage_keys(self.cache, self.load_data.bids_path, self.load_data.train_path)
+        train_ids, train = self.cache.get_or_compute(keys['features'], lambda: self.compute_features(nb_processes))
+        data_set = pd.DataFrame(train, index=train_ids, columns=COLUMN_NAMES)
+        data_set.fillna(0.0, inplace=True)
+        _, mapper = self.return_cleaned_data(data_set)
 
-            self.dump('pickle/train_data_set.pkl', data_set)
+        spec = FeatureSpec.from_positions(mapper)
+        spec.save()
+        return spec
+
+    @staticmethod
+    def build_shards(bidder_offsets, nb_shards):
+        """
+        Split the bidders in contiguous ranges holding about the same number of bids
+        :param bidder_offsets: Offset index of the bid store
+        :param nb_shards: Wanted number of shards
+        :return: List of (first bidder code, last bidder code)
+        """
+        nb_bidders = bidder_offsets.shape[0] - 1
+        targets = np.linspace(0, bidder_offsets[-1], nb_shards + 1)[1:-1]
+        bounds = np.unique(np.concatenate(([0], np.searchsorted(bidder_offsets, targets), [nb_bidders])))
+        return [(int(first), int(last)) for first, last in zip(bounds[:-1], bounds[1:])]
+
+    def compute_features_parallel(self, nb_processes=None, shards_per_process=4, columns=None):
+        """
+        Compute the features with a pool of processes, each reading its shard from the memory-mapped bid store.
+        The cross-bidder features need every bid of an auction: they are computed once in this process.
+        :param nb_processes: Number of processes (all cores by default)
+        :param shards_per_process: Shards per process, more shards smooth the load of big bidders
+        :param columns: Features to compute (all of them by default)
+        :return: train_ids, train (in the same order as the serial engine)
+        """
+        columns = columns or COLUMN_NAMES
+        bidder_columns = [column for column in columns if column not in AUCTION_CONTEXT_COLUMNS]
+        context_columns = [column for column in columns if column in AUCTION_CONTEXT_COLUMNS]
+        if not bidder_columns:
+            return FeatureEngine.from_encoded(self.load_data.encoded_bids).compute(columns)
+
+        nb_processes = nb_processes or multiprocessing.cpu_count()
+        store = self.load_data.bid_store
+        shards = [(store.path, first, last, bidder_columns)
+                  for first, last in self.build_shards(store.bidder_offsets, nb_processes * shards_per_process)]
+
+        train_ids = []
+        train = []
+        pool = multiprocessing.Pool(nb_processes)
+        try:
+            for shard_ids, shard_train in pool.imap(extract_shard, shards):
+                train_ids.extend(shard_ids)
+                train.extend(shard_train)
+        finally:
+            pool.close()
+            pool.join()
+
+        if context_columns:
+            context_ids, context_rows = FeatureEngine.from_encoded(self.load_data.encoded_bids).compute(
+                context_columns)
+            context = dict(zip(context_ids, context_rows))
+            train = [dict(zip(bidder_columns, row), **dict(zip(context_columns, context[bidder_id])))
+                     for bidder_id, row in zip(train_ids, train)]
+            train = [[row[column] for column in columns] for row in train]
+        return train_ids, train
+
+    def compute_features(self, nb_processes=1, columns=None):
+        """
+        Compute the features of every bidder
+        :param nb_processes: Number of processes, 1 to run the engine in this process
+        :param columns: Features to compute (all of them by default)
+        :return: train_ids, train
+        """
+        if nb_processes == 1:
+            return FeatureEngine.from_encoded(self.load_data.encoded_bids).compute(columns)
+        return self.compute_features_parallel(nb_processes, columns=columns)
+
+    def extract(self, nb_processes=1, rebuild_spec=False):
+        """
+        Extract features from initial data
+        :param nb_processes: Number of processes used to compute the features (None for all cores)
+        :param rebuild_spec: Name the legacy positions again even if a feature specification exists
+        :return: features and data_set cache entries
+        """
+        if self.spec is None or rebuild_spec:
+            with PROFILER.stage('Extract.build_feature_spec'):
+                self.spec = self.build_feature_spec(nb_processes)
+        appended_hashes = IncrementalFeatures.appended_hashes(self.cache.file_hash(self.load_data.bids_path))
+        keys = self.stage_keys(self.cache, self.load_data.bids_path, self.load_data.train_path, appended_hashes,
+                               self.spec)
+        if appended_hashes:
+            # The features of the appended files are only in the summaries
+            compute = self.compute_incremental_features
+        else:
+            compute = lambda: self.compute_features(nb_processes, self.spec.raw_columns())
+        with PROFILER.stage('Extract.features', rows=len(self.load_data.encoded_bids),
+                            processes=nb_processes) as record:
+            record['cache_hit'] = self.cache.has(keys['features'])
+            self.train_ids, self.train = self.cache.get_or_compute(keys['features'], compute)
+            record['bidders'] = len(self.train_ids)
+        with PROFILER.stage('Extract.data_set', bidders=len(self.train_ids)) as record:
+            record['cache_hit'] = self.cache.has(keys['data_set'])
+            self.train_data_set = self.cache.get_or_compute(keys['data_set'], self.build_data_set)
+
+    def append(self, bids_path):
+        """
+        Fold a new bids file into the per-bidder summaries and update the features of the bidders it touches
+        :param bids_path: New bids file, with the same columns as bids.csv
+        :return: Ids and feature rows of the touched bidders
+        """
+        with PROFILER.stage('Extract.append') as record:
+            touched_ids, touched_rows = self.fold_bids(bids_path)
+            record['bidders'] = len(touched_ids)
+        return touched_ids, touched_rows
+
+    def compute_incremental_features(self):
+        """
+        Features of every bidder from the summaries of bids.csv and the appended files
+        :return: train_ids, train
+        """
+        summaries = IncrementalFeatures()
+        train_ids = summaries.bidder_ids()
+        return train_ids, summaries.features(train_ids, self.spec.raw_columns())
+
+    def fold_bids(self, bids_path):
+        """
+        Fold a new bids file (see Extract.append).
+        Only the summary buckets of the touched bidders are read and written, but the features entry
+        and the data set are rewritten as a whole: the encoder scaling is refitted on every bidder.
+        A file whose content has already been folded raises ValueError, its bids would be counted twice.
+        """
+        if self.spec is None:
+            self.spec = self.build_feature_spec()
+        source = self.cache.file_hash(self.load_data.bids_path)
+        summaries = IncrementalFeatures()
+        if summaries.source != source:
+            # No summaries yet, or summaries of a former content of bids.csv
+            summaries.reset(source)
+            summaries.fold(self.load_data.encoded_bids.to_frame(), self.load_data.bids_path, source)
+        previous_key = self.stage_keys(self.cache, self.load_data.bids_path, self.load_data.train_path,
+                                       summaries.inputs[1:], self.spec)['features']
+
+        touched_ids = summaries.fold(self.load_data.load_bids(bids_path).to_frame(), bids_path,
+                                     self.cache.file_hash(bids_path))
+        touched_rows = summaries.features(touched_ids, self.spec.raw_columns())
+
+        if self.cache.has(previous_key):
+            features = dict(zip(*self.cache.get(previous_key)))
+            features.update(zip(touched_ids, touched_rows))
+            self.train_ids = sorted(features)
+            self.train = [features[bidder_id] for bidder_id in self.train_ids]
         else:
-            print("Train data set already created")
+            self.train_ids = summaries.bidder_ids()
+            self.train = summaries.features(self.train_ids, self.spec.raw_columns())
+
+        summaries.save()
+        keys = self.stage_keys(self.cache, self.load_data.bids_path, self.load_data.train_path, summaries.inputs[1:],
+                               self.spec)
+        self.cache.put(keys['features'], (self.train_ids, self.train))
+        self.train_data_set = self.cache.get_or_compute(keys['data_set'], self.build_data_set)
+        return touched_ids, touched_rows
+
+    @staticmethod
+    def compute_answer(train):
+        """
+        Outcome of each train bidder
+        :param train: train.csv dataframe
+        """
+        dict_ids_outcome = {}
+        for train_bidder_id, outcome in zip(train['bidder_id'], train['outcome']):
+            dict_ids_outcome[train_bidder_id] = outcome
+        return dict_ids_outcome
+
+    @staticmethod
+    def load_answer(cache, train_path="data/train.csv"):
+        """
+        Build answer data for train from train.csv alone, without opening the bids
+        :param cache: Stage cache
+        :type cache: StageCache
+        :return: answer cache entry
+        """
+        key = Extract.answer_key(cache, train_path)
+        with PROFILER.stage('Extract.load_answer') as record:
+            record['cache_hit'] = cache.has(key)
+            return cache.get_or_compute(key, lambda: Extract.compute_answer(pd.read_csv(train_path, sep=",")))
 
     def build_answer(self):
         """
         Build answer data for train
-        :return: train_answer.pkl
-        """
-        if not os.path.isfile('pickle/train_answer.pkl'):
-            print("Building answers ids data")
-            dict_ids_outcome = {}
-            self.train_ids = self.load('pickle/train_ids.pkl')
-            for train_bidder_id, outcome in zip(self.load_data.train['bidder_id'], self.load_data.train['outcome']):
-                print(train_bidder_id, outcome)
-                dict_ids_outcome[train_bidder_id] = outcome
-            self.train_answer = dict_ids_outcome
-            print(self.train_answer)
-            self.dump('pickle/train_answer.pkl', self.train_answer)
-        else:
-            print("Train answer data set already created")
+        :return: answer cache entry
+        """
+        key = self.answer_key(self.cache, self.load_data.train_path)
+        with PROFILER.stage('Extract.build_answer', rows=len(self.load_data.train)) as record:
+            record['cache_hit'] = self.cache.has(key)
+            self.train_answer = self.cache.get_or_compute(key, lambda: self.compute_answer(self.load_data.train))
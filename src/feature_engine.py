@@ -0,0 +1,405 @@
+"""
+Vectorized feature engine
+"""
+import numpy as np
+import pandas as pd
+
+from src.profiling import PROFILER
+
+
+CATEGORY_COLUMNS = ['ip', 'device', 'merchandise', 'country', 'url', 'auction']
+
+COLUMN_NAMES = [
+    'nb_unique_ip', 'low_freq_ip', 'high_freq_ip', 'std_freq_ip', 'arg_max_ip',
+    'nb_unique_device', 'low_freq_device', 'high_freq_device', 'std_freq_device', 'arg_max_device',
+    'nb_unique_merchandise', 'low_freq_merchandise', 'high_freq_merchandise', 'std_freq_merchandise',
+    'arg_max_merchandise',
+    'nb_unique_country', 'low_freq_country', 'high_freq_country', 'std_freq_country', 'arg_max_country',
+    'nb_unique_url', 'low_freq_url', 'high_freq_url', 'std_freq_url', 'arg_max_url',
+    'nb_unique_auction', 'low_freq_auction', 'high_freq_auction', 'std_freq_auction', 'arg_max_auction',
+    "bid_nb", "min_time", "max_time", "range_time", "min_time_interval", "max_time_interval",
+    "mean_time_interval", "std_time_interval", "time_interval_25", "time_interval_50", "time_interval_75",
+    "mean_of_auction_bid_nb", "std_of_auction_bid_nb", "mean_of_auction_range_time",
+    "std_of_auction_range_time", "min_of_auction_min_time_interval", "mean_of_auction_min_time_interval",
+    "max_auction_max_time_interval", "mean_auction_max_time_interval", "mean_auction_mean_time_interval",
+    "std_auction_mean_time_interval", "mean_auction_std_time_interval"
+]
+
+CATEGORY_PREFIXES = ['nb_unique_', 'low_freq_', 'high_freq_', 'std_freq_', 'arg_max_']
+
+TIME_COLUMNS = COLUMN_NAMES[30:41]
+
+AUCTION_COLUMNS = COLUMN_NAMES[41:]
+
+# Cross-bidder features, computed on the AuctionIndex
+AUCTION_CONTEXT_COLUMNS = [
+    'mean_time_since_competitor', 'min_time_since_competitor', 'last_bid_ratio', 'mean_bid_rank',
+    'mean_auction_bidders', 'mean_bidders_per_ip'
+]
+
+# Every feature the FeatureEngine can compute
+FEATURE_NAMES = COLUMN_NAMES + AUCTION_CONTEXT_COLUMNS
+
+
+def segment_starts(*sorted_keys):
+    """
+    Start positions of the runs of equal keys in already sorted arrays
+    :param sorted_keys: One or several arrays sorted together
+    :return: Array of start positions
+    """
+    n = sorted_keys[0].shape[0]
+    flags = np.zeros(n, dtype=bool)
+    if n:
+        flags[0] = True
+    for keys in sorted_keys:
+        flags[1:] |= keys[1:] != keys[:-1]
+    return np.flatnonzero(flags)
+
+
+def segment_mean_std(values, starts, lengths):
+    """
+    Mean and population standard deviation of each segment (two pass, like np.std)
+    :param values: Float values sorted by segment
+    :param starts: Start position of each segment
+    :param lengths: Length of each segment
+    """
+    mean = np.add.reduceat(values, starts) / lengths
+    deviation = values - np.repeat(mean, lengths)
+    std = np.sqrt(np.add.reduceat(deviation * deviation, starts) / lengths)
+    return mean, std
+
+
+def segment_percentile(sorted_values, starts, lengths, q):
+    """
+    Percentile of each segment with numpy's linear interpolation
+    :param sorted_values: Values sorted by segment then by value
+    :param q: Percentile between 0 and 100
+    """
+    position = (lengths - 1) * (q / 100.0)
+    low = np.floor(position).astype(np.int64)
+    high = np.ceil(position).astype(np.int64)
+    low_values = sorted_values[starts + low]
+    high_values = sorted_values[starts + high]
+    return low_values + (high_values - low_values) * (position - low)
+
+
+def per_bidder_mean(bidder, values, nb_bidders):
+    """
+    Mean of values grouped by bidder code (NaN for a bidder without values)
+    """
+    counts = np.bincount(bidder, minlength=nb_bidders).astype(np.float64)
+    sums = np.bincount(bidder, weights=values, minlength=nb_bidders)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+class AuctionIndex(object):
+    """
+    Bids sorted by (auction, time), with the rank of each bid in its auction,
+    for vectorized lag/lead computations across the bidders of an auction
+    """
+
+    def __init__(self, auction, time, bidder, file_rows):
+        """
+        :param auction: Auction code of each bid
+        :param time: Time of each bid
+        :param bidder: Bidder code of each bid
+        :param file_rows: Position of each bid in the file (breaks the ties of time)
+        """
+        self.order = np.lexsort((file_rows, time, auction))
+        self.auction = auction[self.order]
+        self.time = time[self.order]
+        self.bidder = bidder[self.order]
+
+        nb_rows = self.order.shape[0]
+        self.starts = segment_starts(self.auction)
+        self.lengths = np.diff(np.append(self.starts, nb_rows))
+        self.rank = np.arange(nb_rows) - np.repeat(self.starts, self.lengths)
+        self.auction_length = np.repeat(self.lengths, self.lengths)
+
+    def lag(self, values, fill):
+        """
+        Value of the previous bid of the same auction (fill for the first bid)
+        """
+        lagged = np.empty_like(values)
+        lagged[1:] = values[:-1]
+        lagged[self.rank == 0] = fill
+        return lagged
+
+    def lead(self, values, fill):
+        """
+        Value of the next bid of the same auction (fill for the last bid)
+        """
+        led = np.empty_like(values)
+        led[:-1] = values[1:]
+        led[self.is_last()] = fill
+        return led
+
+    def is_last(self):
+        return self.rank == self.auction_length - 1
+
+    def time_since_competitor(self):
+        """
+        Time since the latest earlier bid of another bidder in the same auction (NaN when there is none)
+        """
+        positions = np.arange(self.rank.shape[0])
+        # Runs of consecutive bids of a same bidder: the bid before a run is a competitor's one
+        run_start = (self.rank == 0) | (self.bidder != self.lag(self.bidder, -1))
+        run_start = np.maximum.accumulate(np.where(run_start, positions, 0))
+        has_competitor = self.rank[run_start] > 0
+        elapsed = np.full(positions.shape[0], np.nan)
+        elapsed[has_competitor] = (self.time[has_competitor] -
+                                   self.time[run_start[has_competitor] - 1]).astype(np.float64)
+        return elapsed
+
+
+class FeatureEngine(object):
+    """
+    Compute the features of Extract.compute_stats_by_categories and
+    Extract.compute_stats_for_time_series_with_group_by for every bidder at once.
+
+    The bids are described by integer codes: bidder codes are sorted like
+    groupby('bidder_id') keys, and rows of a same bidder keep their file order
+    which is the order used by the per-bidder loop to compute time intervals.
+    """
+
+    def __init__(self, bidder, time, categories, bidder_uniques, category_uniques, file_rows=None):
+        """
+        :param bidder: Bidder code of each bid (0 .. n_bidders - 1, sorted keys)
+        :param time: Time of each bid (int64)
+        :param categories: Dict column -> code of each bid
+        :param bidder_uniques: Bidder id of each bidder code
+        :param category_uniques: Dict column -> value of each code
+        :param file_rows: Position of each bid in the file when the bids are not given in file order
+        """
+        self.bidder = np.asarray(bidder, dtype=np.int64)
+        self.time = np.asarray(time, dtype=np.int64)
+        self.categories = categories
+        self.bidder_uniques = bidder_uniques
+        self.category_uniques = category_uniques
+        self.file_rows = np.arange(self.bidder.shape[0]) if file_rows is None else file_rows
+        self.auction_index = None
+
+    @staticmethod
+    def from_frame(bids):
+        """
+        Encode a bids dataframe (as loaded by Load) into a FeatureEngine
+        :param bids: Bids data
+        :type bids: Pandas Dataframe
+        """
+        bidder, bidder_uniques = pd.factorize(bids['bidder_id'], sort=True)
+        categories = {}
+        category_uniques = {}
+        for column in CATEGORY_COLUMNS:
+            categories[column], category_uniques[column] = pd.factorize(bids[column])
+        return FeatureEngine(bidder, bids['time'].values, categories, bidder_uniques, category_uniques)
+
+    @staticmethod
+    def from_encoded(encoded_bids):
+        """
+        Build a FeatureEngine on the codes of Load.encoded_bids, without decoding the strings
+        :param encoded_bids: Bids encoded by Load.load_bids
+        :type encoded_bids: EncodedBids
+        """
+        # Renumber bidder codes in sorted bidder_id order, as groupby('bidder_id') does
+        bidder_dictionary = encoded_bids.dictionaries['bidder_id']
+        order = np.argsort(bidder_dictionary, kind='mergesort')
+        rank = np.empty(order.shape[0], dtype=np.int64)
+        rank[order] = np.arange(order.shape[0])
+        bidder = rank[encoded_bids.codes['bidder_id']]
+
+        categories = {column: encoded_bids.codes[column] for column in CATEGORY_COLUMNS}
+        category_uniques = {column: encoded_bids.dictionaries[column] for column in CATEGORY_COLUMNS}
+        return FeatureEngine(bidder, encoded_bids.time, categories, bidder_dictionary[order], category_uniques,
+                             encoded_bids.file_rows)
+
+    @staticmethod
+    @PROFILER.hook
+    def time_series_stats(time, starts):
+        """
+        Vectorized compute_stats_for_time_series over segments of time
+        :param time: Time data sorted by segment
+        :param starts: Start position of each segment
+        :return: Dict of stats, one array value per segment
+        """
+        n_rows = time.shape[0]
+        lengths = np.diff(np.append(starts, n_rows))
+
+        min_time = np.minimum.reduceat(time, starts).astype(np.float64)
+        max_time = np.maximum.reduceat(time, starts).astype(np.float64)
+
+        # Interval between a bid and the previous one of the segment,
+        # a segment with a single bid has one interval equal to 0
+        first = np.zeros(n_rows, dtype=bool)
+        first[starts] = True
+        interval = np.zeros(n_rows, dtype=np.int64)
+        interval[1:] = time[1:] - time[:-1]
+        interval[first] = 0
+        keep = ~first
+        keep[starts[lengths == 1]] = True
+        interval_lengths = np.maximum(lengths - 1, 1)
+        interval_starts = np.append(0, np.cumsum(interval_lengths)[:-1])
+        segment = np.repeat(np.arange(starts.shape[0]), interval_lengths)
+        interval = interval[keep]
+        sorted_interval = interval[np.lexsort((interval, segment))].astype(np.float64)
+
+        mean_interval, std_interval = segment_mean_std(interval.astype(np.float64), interval_starts,
+                                                       interval_lengths)
+
+        return {
+            'bid_nb': lengths.astype(np.float64),
+            'min_time': min_time,
+            'max_time': max_time,
+            'range_time': max_time - min_time,
+            'min_time_interval': sorted_interval[interval_starts],
+            'max_time_interval': sorted_interval[interval_starts + interval_lengths - 1],
+            'mean_time_interval': mean_interval,
+            'std_time_interval': std_interval,
+            'time_interval_25': segment_percentile(sorted_interval, interval_starts, interval_lengths, 25),
+            'time_interval_50': segment_percentile(sorted_interval, interval_starts, interval_lengths, 50),
+            'time_interval_75': segment_percentile(sorted_interval, interval_starts, interval_lengths, 75),
+        }
+
+    @PROFILER.hook
+    def category_stats(self, column):
+        """
+        Vectorized compute_stats_by_categories for every bidder
+        :param column: Categorical column name
+        :return: nb_unique, low_freq, high_freq, std_freq, arg_max arrays
+        """
+        codes = np.asarray(self.categories[column], dtype=np.int64)
+        n_codes = max(len(self.category_uniques[column]), 1)
+
+        # Pairs read in file order, so that the first index of a pair is its first bid
+        file_order = np.argsort(self.file_rows, kind='mergesort')
+        pairs, first_index, counts = np.unique((self.bidder * n_codes + codes)[file_order], return_index=True,
+                                               return_counts=True)
+        pair_bidder = pairs // n_codes
+        pair_code = pairs % n_codes
+
+        starts = segment_starts(pair_bidder)
+        nb_unique = np.diff(np.append(starts, pairs.shape[0]))
+        n = np.add.reduceat(counts, starts).astype(np.float64)
+        high_count = np.maximum.reduceat(counts, starts)
+        low_count = np.minimum.reduceat(counts, starts)
+        _, std_freq = segment_mean_std(counts / np.repeat(n, nb_unique), starts, nb_unique)
+
+        # On ties the most frequent value is the first one seen in the bids of the bidder
+        is_max = np.flatnonzero(counts == np.repeat(high_count, nb_unique))
+        is_max = is_max[np.lexsort((first_index[is_max], pair_bidder[is_max]))]
+        first_max = is_max[segment_starts(pair_bidder[is_max])]
+        uniques = np.asarray(self.category_uniques[column], dtype=object)
+        arg_max = [str(value) for value in uniques[pair_code[first_max]]]
+
+        return nb_unique.astype(np.float64), low_count / n, high_count / n, std_freq, arg_max
+
+    def bidder_time_stats(self):
+        """
+        Vectorized compute_stats_for_time_series on the bids of each bidder (file order)
+        :return: List of the TIME_COLUMNS arrays
+        """
+        order = np.lexsort((self.file_rows, self.bidder))
+        bidder_stats = self.time_series_stats(self.time[order], segment_starts(self.bidder[order]))
+        return [bidder_stats[name] for name in TIME_COLUMNS]
+
+    def auction_stats(self):
+        """
+        Vectorized auction part of compute_stats_for_time_series_with_group_by(group, 'time', 'auction')
+        :return: List of the AUCTION_COLUMNS arrays
+        """
+        auction = np.asarray(self.categories['auction'], dtype=np.int64)
+
+        # Rows of a (bidder, auction) in file order
+        order = np.lexsort((self.file_rows, auction, self.bidder))
+        sorted_bidder = self.bidder[order]
+        starts = segment_starts(sorted_bidder, auction[order])
+        auction_stats = self.time_series_stats(self.time[order], starts)
+
+        auction_starts = segment_starts(sorted_bidder[starts])
+        nb_auctions = np.diff(np.append(auction_starts, starts.shape[0]))
+
+        mean_bid_nb, std_bid_nb = segment_mean_std(auction_stats['bid_nb'], auction_starts, nb_auctions)
+        mean_range, std_range = segment_mean_std(auction_stats['range_time'], auction_starts, nb_auctions)
+        mean_mean, std_mean = segment_mean_std(auction_stats['mean_time_interval'], auction_starts, nb_auctions)
+        mean_min = np.add.reduceat(auction_stats['min_time_interval'], auction_starts) / nb_auctions
+        mean_max = np.add.reduceat(auction_stats['max_time_interval'], auction_starts) / nb_auctions
+        mean_std = np.add.reduceat(auction_stats['std_time_interval'], auction_starts) / nb_auctions
+
+        return [
+            mean_bid_nb, std_bid_nb, mean_range, std_range,
+            np.minimum.reduceat(auction_stats['min_time_interval'], auction_starts), mean_min,
+            np.maximum.reduceat(auction_stats['max_time_interval'], auction_starts), mean_max,
+            mean_mean, std_mean, mean_std
+        ]
+
+    @PROFILER.hook
+    def auction_context_stats(self):
+        """
+        Cross-bidder features of every bidder, computed on the (auction, time) index
+        :return: List of the AUCTION_CONTEXT_COLUMNS arrays
+        """
+        if self.auction_index is None:
+            self.auction_index = AuctionIndex(np.asarray(self.categories['auction'], dtype=np.int64), self.time,
+                                              self.bidder, self.file_rows)
+        index = self.auction_index
+        nb_bidders = len(self.bidder_uniques)
+
+        elapsed = index.time_since_competitor()
+        with_competitor = ~np.isnan(elapsed)
+        mean_elapsed = per_bidder_mean(index.bidder[with_competitor], elapsed[with_competitor], nb_bidders)
+        min_elapsed = np.full(nb_bidders, np.inf)
+        np.minimum.at(min_elapsed, index.bidder[with_competitor], elapsed[with_competitor])
+        min_elapsed[np.isinf(min_elapsed)] = np.nan
+
+        # Distinct (bidder, auction) pairs give the number of auctions of a bidder and of bidders of an auction
+        pairs = np.unique(index.bidder * np.int64(len(index.starts)) +
+                          np.repeat(np.arange(len(index.starts)), index.lengths))
+        pair_bidder = pairs // len(index.starts)
+        pair_auction = pairs % len(index.starts)
+        auction_bidders = np.bincount(pair_auction, minlength=len(index.starts)).astype(np.float64)
+        nb_auctions = np.bincount(pair_bidder, minlength=nb_bidders).astype(np.float64)
+        last_bids = np.bincount(index.bidder[index.is_last()], minlength=nb_bidders)
+
+        bid_rank = index.rank / np.maximum(index.auction_length - 1, 1).astype(np.float64)
+
+        # Distinct bidders sharing the ip of each bid
+        ip = np.asarray(self.categories['ip'], dtype=np.int64)
+        nb_ips = max(len(self.category_uniques['ip']), 1)
+        ip_bidders = np.bincount(np.unique(self.bidder * np.int64(nb_ips) + ip) % nb_ips,
+                                 minlength=nb_ips).astype(np.float64)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            last_bid_ratio = last_bids / nb_auctions
+        return [
+            mean_elapsed,
+            min_elapsed,
+            last_bid_ratio,
+            per_bidder_mean(index.bidder, bid_rank, nb_bidders),
+            per_bidder_mean(pair_bidder, auction_bidders[pair_auction], nb_bidders),
+            per_bidder_mean(self.bidder, ip_bidders[ip], nb_bidders),
+        ]
+
+    def compute(self, columns=None):
+        """
+        Compute the features of every bidder, skipping the groups of features nobody asked for
+        :param columns: Features to compute, in the order of the rows (the 52 COLUMN_NAMES by default)
+        :return: train_ids, train (same layout as the per-bidder loop of Extract.extract by default)
+        """
+        columns = columns or COLUMN_NAMES
+        values = {}
+        for column in CATEGORY_COLUMNS:
+            names = [prefix + column for prefix in CATEGORY_PREFIXES]
+            if any(name in columns for name in names):
+                values.update(zip(names, self.category_stats(column)))
+        if any(name in columns for name in TIME_COLUMNS):
+            values.update(zip(TIME_COLUMNS, self.bidder_time_stats()))
+        if any(name in columns for name in AUCTION_COLUMNS):
+            values.update(zip(AUCTION_COLUMNS, self.auction_stats()))
+        if any(name in columns for name in AUCTION_CONTEXT_COLUMNS):
+            values.update(zip(AUCTION_CONTEXT_COLUMNS, self.auction_context_stats()))
+
+        train_ids = [bidder_id for bidder_id in self.bidder_uniques]
+        columns_values = [values[name].tolist() if isinstance(values[name], np.ndarray) else values[name]
+                          for name in columns]
+        train = [list(row) for row in zip(*columns_values)]
+        return train_ids, train
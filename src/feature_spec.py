@@ -0,0 +1,169 @@
+"""
+Named feature specification shared by Extract and Model
+"""
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+
+from src.feature_engine import FEATURE_NAMES
+
+
+FEATURE_SPEC_PATH = "feature_spec.json"
+
+# Number of columns of the full binarized data set of the original bids, which LEGACY_POSITIONS refer to
+LEGACY_LAYOUT_SIZE = 8406
+
+# Columns kept by the former Model.feature_selection, as positions in the full binarized data set.
+# This list has been build by analysis of xgb features importance
+LEGACY_POSITIONS = [
+    8395, 1, 8404, 4358, 'pca_1', 8385, 6894, 2, 8387, 8393, 4360, 0, 3689, 'pca_2', 4251, 2797, 8392, 4025, 3690,
+    6891, 3, 8389, 8390, 8391, 4255, 8384, 3691, 8405, 6893, 8394, 8398, 8403, 4303, 4260, 4261, 8396, 8397,
+    3151, 8400, 'pca_3', 4361, 8386, 6892, 4258, 4331, 8401, 7698, 3688, 3974, 4254, 8402, 4259, 4359, 4257,
+    8388, 4300, 6571, 7710, 3938, 4352, 4060, 4253
+]
+
+
+class FeatureSpec(object):
+    """
+    Ordered list of the model features, by name:
+    a numeric feature of FEATURE_NAMES, 'arg_max_<column>=<level>' for a one-hot level, or 'pca_<i>'
+    """
+
+    def __init__(self, features):
+        self.features = list(features)
+
+    @staticmethod
+    def split_level(feature):
+        column, level = feature.split('=', 1)
+        return column, level
+
+    @property
+    def pca_features(self):
+        return [feature for feature in self.features if feature.startswith('pca_')]
+
+    @property
+    def data_features(self):
+        """
+        Features of the data set (all but the PCA ones), in model order
+        """
+        return [feature for feature in self.features if not feature.startswith('pca_')]
+
+    def levels(self):
+        """
+        Dict arg_max column -> one-hot levels to encode
+        """
+        levels = {}
+        for feature in self.data_features:
+            if '=' in feature:
+                column, level = self.split_level(feature)
+                levels.setdefault(column, []).append(level)
+        return levels
+
+    def raw_columns(self):
+        """
+        Columns of FEATURE_NAMES the FeatureEngine has to compute, in FEATURE_NAMES order
+        """
+        needed = set(self.levels())
+        needed.update(feature for feature in self.data_features if '=' not in feature)
+        return [column for column in FEATURE_NAMES if column in needed]
+
+    @staticmethod
+    def load(path=FEATURE_SPEC_PATH):
+        """
+        :return: FeatureSpec, or None when the file does not exist yet
+        """
+        if not os.path.isfile(path):
+            return None
+        with open(path) as spec_file:
+            return FeatureSpec(json.load(spec_file)['features'])
+
+    def save(self, path=FEATURE_SPEC_PATH):
+        with open(path, 'w') as spec_file:
+            json.dump({'features': self.features}, spec_file, indent=2)
+
+    @staticmethod
+    def from_positions(mapper, positions=LEGACY_POSITIONS, layout_size=LEGACY_LAYOUT_SIZE):
+        """
+        Name the positions of a data set built by Extract.return_cleaned_data
+        :param mapper: Fitted DataFrameMapper of the data set
+        :param positions: Column positions (or 'pca_<i>' names)
+        :param layout_size: Number of columns of the data set the positions refer to (None to skip the check)
+        :return: FeatureSpec
+        """
+        layout = []
+        for columns, transformer in mapper.features:
+            if isinstance(columns, list):
+                layout.extend(columns)
+            elif len(transformer.classes_) <= 2:
+                # LabelBinarizer keeps a single column for two classes
+                layout.append('{}={}'.format(columns, transformer.classes_[-1]))
+            else:
+                layout.extend('{}={}'.format(columns, level) for level in transformer.classes_)
+
+        if layout_size is not None and len(layout) != layout_size:
+            raise ValueError("The positions refer to a data set of {} columns, this one has {}: write {} by name "
+                             "instead".format(layout_size, len(layout), FEATURE_SPEC_PATH))
+        features = []
+        for position in positions:
+            if isinstance(position, str):
+                features.append(position)
+            elif position < len(layout):
+                features.append(layout[position])
+            else:
+                raise ValueError("Position {} is not in the data set ({} columns)".format(position, len(layout)))
+        return FeatureSpec(features)
+
+
+class FeatureEncoder(object):
+    """
+    Standard scale the numeric features and one-hot encode the levels of a FeatureSpec,
+    computing only the columns of the specification
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.means = {}
+        self.scales = {}
+
+    def fit(self, data):
+        """
+        :param data: Dataframe of the spec raw columns
+        """
+        for feature in self.spec.data_features:
+            if '=' not in feature:
+                values = data[feature].values.astype(np.float64)
+                scale = np.std(values)
+                self.means[feature] = np.mean(values)
+                self.scales[feature] = scale if scale > 0 else 1.0
+        return self
+
+    def transform(self, data):
+        """
+        :param data: Dataframe of the spec raw columns
+        :return: CSR matrix with the spec data features as columns
+        """
+        rows = []
+        columns = []
+        values = []
+        for position, feature in enumerate(self.spec.data_features):
+            if '=' in feature:
+                column, level = self.spec.split_level(feature)
+                feature_rows = np.flatnonzero(data[column].values == level)
+                feature_values = np.ones(feature_rows.shape[0])
+            else:
+                feature_values = (data[feature].values.astype(np.float64) - self.means[feature]) / self.scales[feature]
+                feature_rows = np.flatnonzero(feature_values)
+                feature_values = feature_values[feature_rows]
+            rows.append(feature_rows)
+            columns.append(np.full(feature_rows.shape[0], position, dtype=np.int64))
+            values.append(feature_values)
+        shape = (len(data), len(self.spec.data_features))
+        if not rows:
+            return sparse.csr_matrix(shape)
+        return sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))),
+                                 shape=shape)
+
+    def fit_transform(self, data):
+        return self.fit(data).transform(data)
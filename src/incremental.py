@@ -0,0 +1,383 @@
+"""
+Incremental feature extraction with mergeable per-bidder summaries
+"""
+import json
+import math
+import os
+import pickle
+import shutil
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from src.cache import StageCache
+from src.feature_engine import AUCTION_CONTEXT_COLUMNS, COLUMN_NAMES
+
+
+class QuantileSketch(object):
+    """
+    Values kept exactly while there are few of them, then counted in log-spaced buckets
+    (relative error bounded by relative_accuracy, as in DDSketch)
+    """
+    __slots__ = ('max_exact', 'gamma', 'values', 'positive', 'negative', 'zero_count', 'count')
+
+    def __init__(self, max_exact=1024, relative_accuracy=0.01):
+        self.max_exact = max_exact
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.values = []
+        self.positive = None
+        self.negative = None
+        self.zero_count = 0
+        self.count = 0
+
+    def bucket(self, value):
+        return int(math.ceil(math.log(value) / math.log(self.gamma)))
+
+    def bucket_value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add_to_buckets(self, values):
+        for value in values:
+            if value > 0:
+                key = self.bucket(value)
+                self.positive[key] = self.positive.get(key, 0) + 1
+            elif value < 0:
+                key = self.bucket(-value)
+                self.negative[key] = self.negative.get(key, 0) + 1
+            else:
+                self.zero_count += 1
+
+    def add(self, values):
+        """
+        Add values to the sketch
+        :param values: Array of values
+        """
+        self.count += len(values)
+        if self.positive is None:
+            self.values.extend(values.tolist())
+            if len(self.values) > self.max_exact:
+                self.positive = {}
+                self.negative = {}
+                self.add_to_buckets(self.values)
+                self.values = []
+        else:
+            self.add_to_buckets(values.tolist())
+
+    def merge(self, other):
+        """
+        Merge another sketch (built with the same accuracy) into this one
+        """
+        if other.positive is None:
+            self.add(np.array(other.values))
+            return
+        if self.positive is None:
+            self.positive = {}
+            self.negative = {}
+            self.add_to_buckets(self.values)
+            self.values = []
+        for key, count in other.positive.items():
+            self.positive[key] = self.positive.get(key, 0) + count
+        for key, count in other.negative.items():
+            self.negative[key] = self.negative.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def value_at(self, rank):
+        """
+        Approximate value of the rank-th smallest value
+        """
+        for key in sorted(self.negative, reverse=True):
+            rank -= self.negative[key]
+            if rank < 0:
+                return -self.bucket_value(key)
+        rank -= self.zero_count
+        if rank < 0:
+            return 0.0
+        for key in sorted(self.positive):
+            rank -= self.positive[key]
+            if rank < 0:
+                return self.bucket_value(key)
+        return self.bucket_value(max(self.positive))
+
+    def percentile(self, q):
+        """
+        Percentile with numpy's linear interpolation between the neighbouring ranks
+        :param q: Percentile between 0 and 100
+        """
+        if self.positive is None:
+            return float(np.percentile(self.values, q))
+        position = (self.count - 1) * (q / 100.0)
+        low = int(math.floor(position))
+        low_value = self.value_at(low)
+        return low_value + (self.value_at(int(math.ceil(position))) - low_value) * (position - low)
+
+
+class TimeSummary(object):
+    """
+    Mergeable summary of a time series read in file order: bid count, first and last time,
+    and running min/max/mean/M2 of the intervals between consecutive bids
+    """
+    __slots__ = ('bid_nb', 'min_time', 'max_time', 'last_time', 'interval_nb', 'min_interval', 'max_interval',
+                 'mean_interval', 'm2_interval', 'sketch')
+
+    def __init__(self, with_sketch=False):
+        self.bid_nb = 0
+        self.min_time = None
+        self.max_time = None
+        self.last_time = None
+        self.interval_nb = 0
+        self.min_interval = None
+        self.max_interval = None
+        self.mean_interval = 0.0
+        self.m2_interval = 0.0
+        self.sketch = QuantileSketch() if with_sketch else None
+
+    def add(self, times):
+        """
+        Fold new bid times (in file order) into the summary
+        :param times: int64 array
+        """
+        if self.bid_nb:
+            intervals = np.diff(np.append(self.last_time, times))
+            self.min_time = min(self.min_time, int(times.min()))
+            self.max_time = max(self.max_time, int(times.max()))
+        else:
+            intervals = np.diff(times)
+            self.min_time = int(times.min())
+            self.max_time = int(times.max())
+        self.bid_nb += len(times)
+        self.last_time = int(times[-1])
+
+        if len(intervals):
+            # Chan et al. merge of (count, mean, M2)
+            batch_nb = len(intervals)
+            batch_mean = float(np.mean(intervals))
+            batch_m2 = float(np.sum((intervals - batch_mean) ** 2))
+            total = self.interval_nb + batch_nb
+            delta = batch_mean - self.mean_interval
+            self.mean_interval += delta * batch_nb / total
+            self.m2_interval += batch_m2 + delta * delta * self.interval_nb * batch_nb / total
+            self.interval_nb = total
+            batch_min = int(intervals.min())
+            batch_max = int(intervals.max())
+            self.min_interval = batch_min if self.min_interval is None else min(self.min_interval, batch_min)
+            self.max_interval = batch_max if self.max_interval is None else max(self.max_interval, batch_max)
+            if self.sketch is not None:
+                self.sketch.add(intervals)
+
+    def stats(self):
+        """
+        Same values as Extract.compute_stats_for_time_series (a single bid has one interval equal to 0)
+        """
+        if self.interval_nb:
+            interval_stats = [float(self.min_interval), float(self.max_interval), self.mean_interval,
+                              math.sqrt(self.m2_interval / self.interval_nb)]
+            if self.sketch is not None:
+                interval_stats.extend([self.sketch.percentile(25), self.sketch.percentile(50),
+                                       self.sketch.percentile(75)])
+        else:
+            interval_stats = [0.0] * (7 if self.sketch is not None else 4)
+        return [float(self.bid_nb), float(self.min_time), float(self.max_time),
+                float(self.max_time - self.min_time)] + interval_stats
+
+
+class BidderSummary(object):
+    """
+    Mergeable summary of all the bids of a bidder
+    """
+    __slots__ = ('counters', 'time', 'auctions')
+
+    counter_columns = ['ip', 'device', 'merchandise', 'country', 'url']
+
+    def __init__(self):
+        # Counters keep the insertion order and category_stats takes the first maximum,
+        # so ties go to the first value seen in the bids of the bidder, as in FeatureEngine
+        self.counters = {column: Counter() for column in self.counter_columns}
+        self.time = TimeSummary(with_sketch=True)
+        self.auctions = {}
+
+    def add(self, bids):
+        """
+        Fold new bids of the bidder (in file order)
+        :param bids: Bids dataframe
+        """
+        for column in self.counter_columns:
+            self.counters[column].update(bids[column].values)
+        self.time.add(bids['time'].values.astype(np.int64))
+        for auction, auction_bids in bids.groupby('auction', sort=False):
+            if auction not in self.auctions:
+                self.auctions[auction] = TimeSummary()
+            self.auctions[auction].add(auction_bids['time'].values.astype(np.int64))
+
+    @staticmethod
+    def category_stats(values, counts):
+        """
+        Same values as Extract.compute_stats_by_categories from the value counts
+        """
+        counts = np.asarray(counts, dtype=np.float64)
+        n = counts.sum()
+        return [float(len(counts)), float(counts.min() / n), float(counts.max() / n), float(np.std(counts / n)),
+                str(values[int(np.argmax(counts))])]
+
+    def features(self):
+        """
+        The 52 features of the bidder, ordered as COLUMN_NAMES
+        """
+        features = []
+        for column in self.counter_columns:
+            counter = self.counters[column]
+            features.extend(self.category_stats(list(counter.keys()), list(counter.values())))
+        auctions = list(self.auctions.keys())
+        features.extend(self.category_stats(auctions, [self.auctions[auction].bid_nb for auction in auctions]))
+
+        features.extend(self.time.stats())
+
+        auction_data = np.array([self.auctions[auction].stats() for auction in auctions])
+        bid_nb, range_time = auction_data[:, 0], auction_data[:, 3]
+        min_interval, max_interval = auction_data[:, 4], auction_data[:, 5]
+        mean_interval, std_interval = auction_data[:, 6], auction_data[:, 7]
+        features.extend([
+            float(np.mean(bid_nb)), float(np.std(bid_nb)), float(np.mean(range_time)), float(np.std(range_time)),
+            float(np.min(min_interval)), float(np.mean(min_interval)), float(np.max(max_interval)),
+            float(np.mean(max_interval)), float(np.mean(mean_interval)), float(np.std(mean_interval)),
+            float(np.mean(std_interval))
+        ])
+        return features
+
+
+class IncrementalFeatures(object):
+    """
+    Per-bidder summaries of every bids file folded so far.
+
+    The summaries are split in buckets of bidders, so that folding a file only loads and rewrites the buckets
+    of the bidders it touches, and a small manifest records the content hash of the initial bids file
+    and of the files folded after it (their paths are only kept for information: a folded file may be
+    rotated away).
+    """
+
+    def __init__(self, path="pickle/incremental", nb_buckets=64):
+        """
+        :param path: Directory holding the manifest and the summary buckets
+        :param nb_buckets: Number of buckets of bidders
+        """
+        self.path = path
+        self.nb_buckets = nb_buckets
+        manifest = self.load_manifest(path)
+        self.source = manifest.get('source')
+        self.inputs = manifest.get('inputs', [])
+        self.paths = manifest.get('paths', [])
+        self.buckets = {}
+        self.changed = set()
+
+    @staticmethod
+    def load(pickle_name):
+        with open(pickle_name, 'rb') as data_file:
+            data = pickle.load(data_file)
+        return data
+
+    @staticmethod
+    def load_manifest(path="pickle/incremental"):
+        manifest_path = os.path.join(path, 'manifest.json')
+        if not os.path.isfile(manifest_path):
+            return {}
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)
+
+    @staticmethod
+    def appended_hashes(source_hash, path="pickle/incremental"):
+        """
+        Content hashes of the bids files appended after the initial bids file, read from the manifest
+        :param source_hash: Content hash of the initial bids file (see StageCache.file_hash)
+        """
+        manifest = IncrementalFeatures.load_manifest(path)
+        if manifest.get('source') != source_hash:
+            return []
+        return manifest['inputs'][1:]
+
+    def reset(self, source_hash):
+        """
+        Forget every summary, before folding the initial bids file of the given content hash
+        """
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        self.source = source_hash
+        self.inputs = []
+        self.paths = []
+        self.buckets = {}
+        self.changed = set()
+
+    def bucket(self, bidder_id):
+        return zlib.crc32(bidder_id.encode('utf-8')) % self.nb_buckets
+
+    def bucket_path(self, bucket):
+        return os.path.join(self.path, 'summaries_{:03d}.pkl'.format(bucket))
+
+    def summaries(self, bucket):
+        """
+        Dict bidder id -> BidderSummary of a bucket, loaded on first use
+        """
+        if bucket not in self.buckets:
+            bucket_path = self.bucket_path(bucket)
+            self.buckets[bucket] = self.load(bucket_path) if os.path.isfile(bucket_path) else {}
+        return self.buckets[bucket]
+
+    def bidder_ids(self):
+        """
+        Sorted ids of every summarized bidder (loads every bucket)
+        """
+        return sorted(bidder_id for bucket in range(self.nb_buckets) for bidder_id in self.summaries(bucket))
+
+    def fold(self, bids, bids_path, bids_hash):
+        """
+        Fold new bids into the summaries
+        :param bids: Bids dataframe, in file order
+        :param bids_path: File the bids come from
+        :param bids_hash: Content hash of the file (see StageCache.file_hash)
+        :return: Sorted ids of the bidders touched by the new bids
+        """
+        if bids_hash in self.inputs:
+            raise ValueError("{} has already been folded (same content as {})".format(
+                bids_path, self.paths[self.inputs.index(bids_hash)]))
+        for bidder_id, bidder_bids in bids.groupby('bidder_id', sort=False):
+            bucket = self.bucket(bidder_id)
+            summaries = self.summaries(bucket)
+            if bidder_id not in summaries:
+                summaries[bidder_id] = BidderSummary()
+            summaries[bidder_id].add(bidder_bids)
+            self.changed.add(bucket)
+        self.inputs.append(bids_hash)
+        self.paths.append(bids_path)
+        return sorted(bids['bidder_id'].unique())
+
+    def save(self):
+        """
+        Write the changed buckets, then the manifest
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        for bucket in sorted(self.changed):
+            StageCache.atomic_dump(self.bucket_path(bucket), self.buckets[bucket])
+        self.changed = set()
+        manifest_path = os.path.join(self.path, 'manifest.json')
+        tmp_path = '{}.{}.tmp'.format(manifest_path, os.getpid())
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump({'source': self.source, 'inputs': self.inputs, 'paths': self.paths}, manifest_file, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    def features(self, bidder_ids, columns=None):
+        """
+        Feature rows of some bidders
+        :param bidder_ids: Bidder ids
+        :param columns: Features to keep, in this order (the 52 COLUMN_NAMES by default)
+        :return: List of feature rows
+        """
+        context_columns = [column for column in columns or [] if column in AUCTION_CONTEXT_COLUMNS]
+        if context_columns:
+            raise ValueError("Cross-bidder features can not be folded incrementally: {}".format(context_columns))
+        positions = [COLUMN_NAMES.index(column) for column in columns or COLUMN_NAMES]
+        rows = []
+        for bidder_id in bidder_ids:
+            features = self.summaries(self.bucket(bidder_id))[bidder_id].features()
+            rows.append([features[position] for position in positions])
+        return rows
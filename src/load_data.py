@@ -1,13 +1,216 @@
 """
 Data Loader
 """
+import os
+import pickle
+import shutil
+import numpy as np
 import pandas as pd
 
+from src.profiling import PROFILER
+
+
+BIDS_STRING_COLUMNS = ['bidder_id', 'auction', 'merchandise', 'device', 'country', 'ip', 'url']
+
+# Value given to missing data, column by column (the former bids.fillna(0))
+BIDS_MISSING_VALUES = {
+    'bidder_id': '0',
+    'auction': '0',
+    'merchandise': '0',
+    'device': '0',
+    'country': '0',
+    'ip': '0',
+    'url': '0',
+    'time': 0,
+}
+
+
+class EncodedBids(object):
+    """
+    Bids stored column by column: string columns as int32 codes into shared dictionaries, time as int64
+    """
+
+    def __init__(self, codes, dictionaries, time, file_rows=None):
+        """
+        :param codes: Dict column -> int32 code of each bid
+        :param dictionaries: Dict column -> array of the value of each code
+        :param time: Time of each bid (int64)
+        :param file_rows: Position of each bid in bids.csv when the bids are not in file order
+        """
+        self.codes = codes
+        self.dictionaries = dictionaries
+        self.time = time
+        self.file_rows = file_rows
+
+    def __len__(self):
+        return self.time.shape[0]
+
+    def decode(self, column, rows=None):
+        """
+        Values of a string column
+        :param column: Column name
+        :param rows: Optional row selection
+        """
+        codes = self.codes[column] if rows is None else self.codes[column][rows]
+        return self.dictionaries[column][codes]
+
+    def to_frame(self, rows=None):
+        """
+        Decode the bids into a dataframe (same content as the former Load.bids), in file order
+        :param rows: Optional row selection
+        """
+        if self.file_rows is not None:
+            if rows is None:
+                rows = np.arange(len(self))
+            rows = rows[np.argsort(self.file_rows[rows], kind='mergesort')]
+        data = pd.DataFrame({column: self.decode(column, rows) for column in BIDS_STRING_COLUMNS})
+        data['time'] = self.time if rows is None else self.time[rows]
+        return data
+
+
+class BidStore(object):
+    """
+    On-disk columnar copy of the bids: one memory-mapped .npy file per column, rows sorted by
+    bidder_id, auction and time, and an offset index giving the rows of each bidder
+    """
+
+    def __init__(self, path):
+        """
+        Open a store built by BidStore.build (the columns are memory-mapped, not read)
+        :param path: Store directory
+        """
+        self.path = path
+        self.meta = self.load_pickle(os.path.join(path, 'meta.pkl'))
+        dictionaries = self.load_pickle(os.path.join(path, 'dictionaries.pkl'))
+        codes = {column: self.open_column(column) for column in BIDS_STRING_COLUMNS}
+        self.encoded_bids = EncodedBids(codes, dictionaries, self.open_column('time'), self.open_column('file_row'))
+        self.bidder_offsets = self.open_column('bidder_offsets')
+        self.bidder_codes = {bidder_id: code for code, bidder_id in enumerate(dictionaries['bidder_id'])}
+
+    @staticmethod
+    def load_pickle(pickle_name):
+        with open(pickle_name, 'rb') as data_file:
+            data = pickle.load(data_file)
+        return data
+
+    @staticmethod
+    def dump_pickle(pickle_name, object_to_dump):
+        with open(pickle_name, 'wb') as data_file:
+            pickle.dump(object_to_dump, data_file)
+
+    def open_column(self, column):
+        return np.load(os.path.join(self.path, column + '.npy'), mmap_mode='r')
+
+    @staticmethod
+    def source_signature(source_path):
+        """
+        Size and modification time of the csv the store has been built from
+        """
+        status = os.stat(source_path)
+        return status.st_size, status.st_mtime
+
+    @staticmethod
+    def is_up_to_date(path, source_path):
+        """
+        Check that a store exists and has been built from the current version of source_path
+        """
+        meta_path = os.path.join(path, 'meta.pkl')
+        if not os.path.isfile(meta_path):
+            return False
+        if not os.path.isfile(source_path):
+            return True
+        return BidStore.load_pickle(meta_path)['source'] == BidStore.source_signature(source_path)
+
+    @staticmethod
+    def build(encoded_bids, path, source_path=None):
+        """
+        Sort the bids by bidder_id, auction and time and write the store
+        :param encoded_bids: Bids encoded by Load.load_bids
+        :param path: Store directory
+        :param source_path: Csv the bids come from
+        :return: BidStore
+        """
+        # Renumber bidders in sorted bidder_id order so that the offset index follows groupby('bidder_id')
+        bidder_dictionary = encoded_bids.dictionaries['bidder_id']
+        bidder_order = np.argsort(bidder_dictionary, kind='mergesort')
+        bidder_rank = np.empty(bidder_order.shape[0], dtype=np.int32)
+        bidder_rank[bidder_order] = np.arange(bidder_order.shape[0], dtype=np.int32)
+        bidder = bidder_rank[encoded_bids.codes['bidder_id']]
+
+        file_row = np.arange(len(encoded_bids), dtype=np.int64)
+        order = np.lexsort((file_row, encoded_bids.time, encoded_bids.codes['auction'], bidder))
+
+        tmp_path = path + '.tmp'
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        np.save(os.path.join(tmp_path, 'bidder_id.npy'), bidder[order])
+        np.save(os.path.join(tmp_path, 'bidder_offsets.npy'),
+                np.append(0, np.cumsum(np.bincount(bidder, minlength=bidder_order.shape[0]))).astype(np.int64))
+        del bidder
+        for column in BIDS_STRING_COLUMNS:
+            if column != 'bidder_id':
+                np.save(os.path.join(tmp_path, column + '.npy'), encoded_bids.codes[column][order])
+        np.save(os.path.join(tmp_path, 'time.npy'), encoded_bids.time[order])
+        np.save(os.path.join(tmp_path, 'file_row.npy'), file_row[order])
+
+        dictionaries = dict(encoded_bids.dictionaries)
+        dictionaries['bidder_id'] = bidder_dictionary[bidder_order]
+        BidStore.dump_pickle(os.path.join(tmp_path, 'dictionaries.pkl'), dictionaries)
+        BidStore.dump_pickle(os.path.join(tmp_path, 'meta.pkl'), {
+            'nb_rows': len(encoded_bids),
+            'source': BidStore.source_signature(source_path) if source_path else None,
+        })
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+        return BidStore(path)
+
+    def bidder_slice(self, bidder_id):
+        """
+        Rows of a bidder in the store
+        :param bidder_id: Bidder id
+        :return: slice
+        """
+        code = self.bidder_codes[bidder_id]
+        return slice(int(self.bidder_offsets[code]), int(self.bidder_offsets[code + 1]))
+
+    def bidder_bids(self, bidder_id):
+        """
+        Bids of a bidder as zero-copy views on the memory-mapped columns
+        :param bidder_id: Bidder id
+        :return: EncodedBids
+        """
+        return self.slice_bids(self.bidder_slice(bidder_id))
+
+    def bidder_range_bids(self, first_bidder, last_bidder):
+        """
+        Bids of the bidders first_bidder .. last_bidder - 1 (bidder codes) as zero-copy views
+        :return: EncodedBids
+        """
+        return self.slice_bids(slice(int(self.bidder_offsets[first_bidder]), int(self.bidder_offsets[last_bidder])))
+
+    def slice_bids(self, rows):
+        """
+        Contiguous rows of the store as zero-copy views
+        :param rows: slice
+        :return: EncodedBids
+        """
+        encoded_bids = self.encoded_bids
+        return EncodedBids({column: codes[rows] for column, codes in encoded_bids.codes.items()},
+                           encoded_bids.dictionaries, encoded_bids.time[rows], encoded_bids.file_rows[rows])
+
 
 class Load(object):
 
-    def __init__(self):
-        self.bids = None
+    def __init__(self, max_memory=512 * 1024 ** 2):
+        """
+        :param max_memory: Memory ceiling (in bytes) for the csv chunk being parsed
+        """
+        self.encoded_bids = None
+        self.bid_store = None
         self.train = None
         self.test = None
         self.train_test_concat = None
@@ -15,16 +218,74 @@ class Load(object):
         self.bids_path = "data/bids.csv"
         self.train_path = "data/train.csv"
         self.test_path = "data/test.csv"
+        self.store_path = "data/bids_store"
+
+        self.max_memory = max_memory
+        self.first_chunk_rows = 100000
 
         self.load_initial_data()
 
+    def load_bids(self, bids_path=None):
+        """
+        Read bids.csv chunk by chunk and dictionary encode its string columns
+        :param bids_path: Bids file to read instead of bids.csv
+        :return: EncodedBids
+        """
+        dtypes = {column: str for column in BIDS_STRING_COLUMNS}
+        dtypes['time'] = 'Int64'
+        reader = pd.read_csv(bids_path or self.bids_path, sep=",", usecols=BIDS_STRING_COLUMNS + ['time'], dtype=dtypes,
+                             iterator=True)
+
+        dictionaries = {column: {} for column in BIDS_STRING_COLUMNS}
+        codes = {column: [] for column in BIDS_STRING_COLUMNS}
+        times = []
+
+        chunk_rows = self.first_chunk_rows
+        while True:
+            try:
+                chunk = reader.get_chunk(chunk_rows)
+            except StopIteration:
+                break
+
+            for column in BIDS_STRING_COLUMNS:
+                chunk_codes, chunk_uniques = pd.factorize(chunk[column].fillna(BIDS_MISSING_VALUES[column]))
+                dictionary = dictionaries[column]
+                mapping = np.array([dictionary.setdefault(value, len(dictionary)) for value in chunk_uniques],
+                                   dtype=np.int32)
+                codes[column].append(mapping[chunk_codes])
+            times.append(chunk['time'].fillna(BIDS_MISSING_VALUES['time']).values.astype(np.int64))
+
+            # Size the next chunk so that the parsed text stays under the memory ceiling
+            bytes_per_row = chunk.memory_usage(deep=True).sum() / float(max(len(chunk), 1))
+            chunk_rows = max(int(self.max_memory / bytes_per_row), 1000)
+            del chunk
+
+        if not times:
+            times = [np.empty(0, dtype=np.int64)]
+        return EncodedBids(
+            {column: np.concatenate(codes[column]) if codes[column] else np.empty(0, dtype=np.int32)
+             for column in BIDS_STRING_COLUMNS},
+            {column: np.array(list(dictionaries[column]), dtype=object) for column in BIDS_STRING_COLUMNS},
+            np.concatenate(times)
+        )
+
     def load_initial_data(self):
         """
         Load initial data for the model
         """
-        self.bids = pd.read_csv(self.bids_path, sep=",")
-        self.bids.fillna(0, inplace=True)
-        self.train = pd.read_csv(self.train_path, sep=",")
-        self.test = pd.read_csv(self.test_path, sep=",")
-        # self.test['outcome'] = -1.0
-        self.train_test_concat = pd.concat((self.train, self.test))
+        if not BidStore.is_up_to_date(self.store_path, self.bids_path):
+            with PROFILER.stage('Load.load_bids') as record:
+                encoded_bids = self.load_bids()
+                record['rows'] = len(encoded_bids)
+            with PROFILER.stage('BidStore.build', rows=len(encoded_bids)):
+                BidStore.build(encoded_bids, self.store_path, self.bids_path)
+            del encoded_bids
+        with PROFILER.stage('Load.open_store') as record:
+            self.bid_store = BidStore(self.store_path)
+            self.encoded_bids = self.bid_store.encoded_bids
+            record['rows'] = len(self.encoded_bids)
+        with PROFILER.stage('Load.train_test'):
+            self.train = pd.read_csv(self.train_path, sep=",")
+            self.test = pd.read_csv(self.test_path, sep=",")
+            # self.test['outcome'] = -1.0
+            self.train_test_concat = pd.concat((self.train, self.test))
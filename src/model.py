@@ -1,30 +1,84 @@
 """
 Study model
 """
+import hashlib
+import json
+import multiprocessing
+import os
 import pickle
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 import xgboost as xgb
 import numpy as np
 # from matplotlib import pyplot
 
-from sklearn.decomposition import PCA
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import PolynomialFeatures
-from tpot import TPOTClassifier
+from scipy import sparse
+from sklearn.model_selection import StratifiedKFold, train_test_split
+
+from src import decomposition
+from src.cache import StageCache
+from src.extract_features import Extract
+from src.feature_spec import FeatureSpec, FEATURE_SPEC_PATH
+from src.profiling import PROFILER
+from src.search import HalvingSearch
+from src.streaming import FeatureBatches
+from src.transform import FeatureTransform
+
+
+MODEL_BUNDLE_PATH = "model/bundle"
+
+# Version of the bundle layout, bumped when the files or the manifest change
+BUNDLE_VERSION = 2
+
+# Report of Model.param_search, its best params and rounds are used by Model.train on the same data set and spec
+SEARCH_REPORT_PATH = "result/search_report.json"
+
+# TPOT releases (from, until excluded) whose private population attributes the checkpoints rely on
+TPOT_VERSIONS = ((0, 10), (0, 13))
 
 
 class Model(object):
-    def __init__(self):
-        self.train_data = self.load('pickle/train_data_set.pkl')
-        self.train_answer = self.load('pickle/train_answer.pkl')
-        self.test_data = [test_id for test_id in pd.read_csv("data/test.csv", sep=',')['bidder_id']]
+    def __init__(self, test_data=None, spec=None):
+        """
+        :param test_data: Test bidder ids (read from data/test.csv when Model.test needs them by default)
+        :param spec: Feature specification (read from FEATURE_SPEC_PATH by default)
+        :type spec: FeatureSpec
+        """
+        self.cache = StageCache()
+        self.spec = spec or FeatureSpec.load()
+        if self.spec is None:
+            raise IOError("{} not found, run Extract.extract first".format(FEATURE_SPEC_PATH))
+        self.keys = Extract.stage_keys(self.cache, spec=self.spec)
+        self.train_data = self.load_stage(self.keys['data_set'])
+        self.answer = None
+        self.test_data = test_data
         self.mapper = None
-        self.feature_engineering_column = None
-        self.poly = None
+        self.transform = None
         self.model = None
-        self.n_comp = 3
-        self.pca = None
-        self.t_svd = None
+        self.num_boost_rounds = 1250
+        self.n_comp = len(self.spec.pca_features)
+        self.tuned_params = {}
+        if os.path.isfile(SEARCH_REPORT_PATH):
+            with open(SEARCH_REPORT_PATH) as report_file:
+                report = json.load(report_file)
+            # A search only applies to the data set and features it ran on
+            if report.get('data_set') == self.keys['data_set'] and report.get('features') == self.spec.features:
+                self.tuned_params = report['best_params']
+                self.num_boost_rounds = report['best_rounds']
+            else:
+                print("{} was searched on another data set or spec, ignored".format(SEARCH_REPORT_PATH))
+
+    @property
+    def train_answer(self):
+        """
+        Outcome of the train bidders, only loaded by the training paths (predict does not need it)
+        """
+        if self.answer is None:
+            self.answer = self.load_stage(self.keys['answer'])
+        return self.answer
 
     @staticmethod
     def load(pickle_name):
@@ -32,75 +86,47 @@ class Model(object):
             data = pickle.load(data_file)
         return data
 
-    def feature_engineering(self, data, answer=None):
+    def load_stage(self, key):
         """
-        Feature engineering for data (PCA, etc...)
-        :param data: Data to fit_transform
-        :param answer: Answer series for data
-        :return: Data with new features
+        Load the result of an extraction stage from the cache
+        :param key: Stage key
         """
-        if answer:
-            # PCA
-            self.pca = PCA(n_components=self.n_comp, random_state=420)
-            self.pca.fit(np.nan_to_num(data), answer)
-            pca_results_train = self.pca.transform(np.nan_to_num(data))
-
-            # tSVD
-            # self.t_svd = KernelPCA(n_components=self.n_comp, random_state=420)
-            # t_svd_results_train = self.t_svd.fit_transform((np.nan_to_num(data)))
-
-            data = pd.DataFrame(data)
-
-            for i in range(1, self.n_comp + 1):
-                data['pca_' + str(i)] = pca_results_train[:, i - 1]
-                # data['t_svd_' + str(i)] = t_svd_results_train[:, i - 1]
-        else:
-
-            pca_results_test = self.pca.transform(np.nan_to_num(data))
-
-            # t_svd_results_test = self.t_svd.transform(np.nan_to_num(data))
-
-            data = pd.DataFrame(data)
-
-            for i in range(1, self.n_comp + 1):
-                data['pca_' + str(i)] = pca_results_test[:, i - 1]
-                # data['t_svd_' + str(i)] = t_svd_results_test[:, i - 1]
-
-        return data
+        if not self.cache.has(key):
+            raise IOError("{} is not in the cache, run Extract.extract and Extract.build_answer first".format(key))
+        return self.cache.get(key)
 
-    @staticmethod
-    def feature_selection(data):
+    def select_rows(self, bidder_ids):
         """
-        This list has been build by analysis of xgb features importance
+        Rows of the sparse data set for some bidders, a bidder without bids gets an empty row
+        :param bidder_ids: Bidder ids
+        :return: CSR matrix
         """
-        return data[
-            [8395, 1, 8404, 4358, 'pca_1', 8385, 6894, 2, 8387, 8393, 4360, 0, 3689, 'pca_2', 4251, 2797, 8392, 4025, 3690,
-             6891, 3, 8389, 8390, 8391, 4255, 8384, 3691, 8405, 6893, 8394, 8398, 8403, 4303, 4260, 4261, 8396, 8397,
-             3151, 8400, 'pca_3', 4361, 8386, 6892, 4258, 4331, 8401, 7698, 3688, 3974, 4254, 8402, 4259, 4359, 4257,
-             8388, 4300, 6571, 7710, 3938, 4352, 4060, 4253]
-
-        ]
+        positions = {bidder_id: position for position, bidder_id in enumerate(self.train_data['ids'])}
+        rows = []
+        columns = []
+        for row, bidder_id in enumerate(bidder_ids):
+            if bidder_id in positions:
+                rows.append(row)
+                columns.append(positions[bidder_id])
+        selector = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(bidder_ids), len(positions)))
+        return selector.dot(self.train_data['matrix']).tocsr()
 
-    def train(self):
+    def build_train_matrix(self):
         """
-        Train the model
+        Fit the feature engineering on the train bidders
+        :return: Float32 train matrix (after polynomial features), answers
         """
-        train = pd.DataFrame(data=self.train_data, index=self.train_answer.keys())
         answer = [int(value) for value in self.train_answer.values()]
-        train = self.feature_engineering(train, answer)
-        self.feature_engineering_column = train.columns.tolist()
-        train = pd.DataFrame(data=train, columns=self.feature_engineering_column, index=self.train_answer.keys())
-        train = self.feature_selection(train)
-
-        self.poly = PolynomialFeatures(2)
-        train = self.poly.fit_transform(np.nan_to_num(train))
-
-        print(len(train), len(answer))
+        with PROFILER.stage('Model.feature_engineering', bidders=len(answer)):
+            self.mapper = self.train_data['mapper']
+            train = self.select_rows(list(self.train_answer.keys()))
+            self.transform = FeatureTransform(self.spec).fit(train, answer)
+            train = self.transform.transform(train)
+        return train, answer
 
+    def xgb_params(self):
         y_mean = np.mean([int(value) for value in self.train_answer.values()])
-        num_boost_rounds = 1250
-
-        xgb_params = {
+        params = {
             'n_trees': 9000,
             'eta': 0.06,
             'max_depth': 5,
@@ -110,46 +136,363 @@ class Model(object):
             'base_score': y_mean,  # base prediction = mean(target)
             'silent': 1
         }
+        # Params found by Model.param_search
+        params.update(self.tuned_params)
+        return params
 
-        d_matrix_train = xgb.DMatrix(train, answer)
-        self.model = xgb.train(dict(xgb_params, silent=0), d_matrix_train, num_boost_round=num_boost_rounds)
+    def train(self, num_boost_rounds=None, n_threads=None):
+        """
+        Train the model on the cached train DMatrix, with histogram tree building like train_cv
+        :param num_boost_rounds: Boosting rounds (the best round found by train_cv or param_search, else 1250)
+        :param n_threads: Threads (all cores by default)
+        """
+        # Kept on the model so that the bundle records the rounds actually trained
+        self.num_boost_rounds = num_boost_rounds = num_boost_rounds or self.num_boost_rounds
+        n_threads = n_threads or multiprocessing.cpu_count()
+        d_matrix_train, cached = self.train_d_matrix()
+
+        with PROFILER.stage('Model.xgb_train', bidders=d_matrix_train.num_row(), rounds=num_boost_rounds,
+                            d_matrix_cached=cached):
+            params = dict(self.xgb_params(), silent=0, tree_method='hist', nthread=n_threads)
+            self.model = xgb.train(params, d_matrix_train, num_boost_round=num_boost_rounds)
 
         # print(self.model.get_fscore().items())
         # xgb.plot_importance(self.model)
         # pyplot.show()
 
+    def train_streaming(self, num_boost_rounds=None, batch_rows=65536, external_memory=False):
+        """
+        Train without building the whole expanded train matrix: xgboost builds its matrix from one expanded
+        slice of the sparse train rows at a time
+        :param num_boost_rounds: Boosting rounds (the best round found by train_cv if it ran, else 1250)
+        :param batch_rows: Rows per slice, the peak memory grows with it
+        :param external_memory: Keep the xgboost pages on disk too (external memory DMatrix) instead of
+        building an in-memory QuantileDMatrix
+        """
+        answer = [int(value) for value in self.train_answer.values()]
+        # Kept on the model so that the bundle records the rounds actually trained
+        self.num_boost_rounds = num_boost_rounds = num_boost_rounds or self.num_boost_rounds
+        with PROFILER.stage('Model.feature_engineering', bidders=len(answer)):
+            self.mapper = self.train_data['mapper']
+            train = self.select_rows(list(self.train_answer.keys()))
+            self.transform = FeatureTransform(self.spec).fit(train, answer)
+
+        # The iterator keeps its own float32 copy of the sparse rows, nothing is written to disk but the
+        # xgboost pages in external memory mode
+        cache_prefix = os.path.join(self.cache.path, 'xgb_cache') if external_memory else None
+        batches = FeatureBatches(train, answer, self.transform, batch_rows, cache_prefix=cache_prefix)
+        del train
+
+        params = dict(self.xgb_params(), tree_method='hist', silent=0)
+        with PROFILER.stage('Model.xgb_train_streaming', bidders=len(answer), rounds=num_boost_rounds,
+                            external_memory=external_memory):
+            if external_memory:
+                d_matrix_train = xgb.DMatrix(batches)
+            else:
+                d_matrix_train = xgb.QuantileDMatrix(batches)
+            del batches
+            self.model = xgb.train(params, d_matrix_train, num_boost_round=num_boost_rounds)
+
+    @staticmethod
+    def file_checksum(file_name):
+        sha = hashlib.sha1()
+        with open(file_name, 'rb') as data_file:
+            for block in iter(lambda: data_file.read(1024 ** 2), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def save_bundle(self, path=MODEL_BUNDLE_PATH):
+        """
+        Save the trained model as a versioned bundle: the booster in xgboost format, the fitted encoder,
+        PCA and polynomial features, and a manifest describing the expected input
+        :param path: Bundle directory, replaced as a whole once the new bundle is written
+        :return: Manifest
+        """
+        if self.model is None:
+            raise ValueError("The model is not trained, run Model.train first")
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        self.model.save_model(os.path.join(tmp_path, 'booster.model'))
+        StageCache.atomic_dump(os.path.join(tmp_path, 'transforms.pkl'), {
+            'mapper': self.mapper,
+            'transform': self.transform,
+        })
+        manifest = {
+            'version': BUNDLE_VERSION,
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'xgboost_version': xgb.__version__,
+            'features': self.spec.features,
+            'raw_columns': self.spec.raw_columns(),
+            'columns': self.transform.features,
+            'n_outputs': self.transform.n_outputs,
+            'num_boost_rounds': self.num_boost_rounds,
+            'data_set': Extract.stage_keys(self.cache, spec=self.spec)['data_set'],
+            'checksums': {file_name: self.file_checksum(os.path.join(tmp_path, file_name))
+                          for file_name in ['booster.model', 'transforms.pkl']},
+        }
+        with open(os.path.join(tmp_path, 'manifest.json'), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+        old_path = '{}.{}.old'.format(path, os.getpid())
+        if os.path.isdir(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path)
+        return manifest
+
+    def load_bundle(self, path=MODEL_BUNDLE_PATH, check_data_set=True):
+        """
+        Load a bundle saved by Model.save_bundle instead of training
+        :param path: Bundle directory
+        :param check_data_set: Refuse a bundle trained on another data set (Model.test predicts rows of the
+        current data set, which must be encoded like the train rows of the bundle)
+        :return: Manifest
+        """
+        manifest_path = os.path.join(path, 'manifest.json')
+        if not os.path.isfile(manifest_path):
+            raise IOError("{} not found, run Model.train and Model.save_bundle first".format(manifest_path))
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+
+        if manifest.get('version') != BUNDLE_VERSION:
+            raise ValueError("Bundle version {} is not supported (expected {})".format(manifest.get('version'),
+                                                                                       BUNDLE_VERSION))
+        for file_name, checksum in manifest['checksums'].items():
+            if self.file_checksum(os.path.join(path, file_name)) != checksum:
+                raise ValueError("{} of the bundle is corrupted".format(file_name))
+        if manifest['features'] != self.spec.features:
+            raise ValueError("The bundle was trained on another feature specification than {}".format(
+                FEATURE_SPEC_PATH))
+        if check_data_set and manifest['data_set'] != Extract.stage_keys(self.cache, spec=self.spec)['data_set']:
+            raise ValueError("The bundle was trained on another data set, train a new model")
+
+        transforms = self.load(os.path.join(path, 'transforms.pkl'))
+        self.mapper = transforms['mapper']
+        self.transform = transforms['transform']
+        self.model = xgb.Booster(model_file=os.path.join(path, 'booster.model'))
+        self.num_boost_rounds = manifest['num_boost_rounds']
+        return manifest
+
+    def train_d_matrix(self):
+        """
+        Train DMatrix, kept in xgboost binary format in the cache so that repeated runs skip the conversion.
+        The fitted feature transform is kept next to it, so Model.transform is set either way.
+        :return: DMatrix, True if it was loaded from the cache
+        """
+        keys = Extract.stage_keys(self.cache, spec=self.spec)
+        version = self.cache.code_version(Model.build_train_matrix, FeatureTransform, decomposition)
+        key = self.cache.key('d_matrix', version, params={'n_comp': self.n_comp},
+                             upstream=[keys['data_set'], keys['answer']])
+        buffer_path = os.path.join(self.cache.path, key + '.buffer')
+        transform_path = os.path.join(self.cache.path, key + '.transform.pkl')
+        if os.path.isfile(buffer_path) and os.path.isfile(transform_path):
+            PROFILER.increment('cache_hits')
+            self.mapper = self.train_data['mapper']
+            self.transform = self.load(transform_path)
+            return xgb.DMatrix(buffer_path), True
+
+        PROFILER.increment('cache_misses')
+        train, answer = self.build_train_matrix()
+        StageCache.atomic_dump(transform_path, self.transform)
+        d_matrix = xgb.DMatrix(train, answer)
+        tmp_path = '{}.{}.tmp'.format(buffer_path, os.getpid())
+        d_matrix.save_binary(tmp_path)
+        os.replace(tmp_path, buffer_path)
+        return d_matrix, False
+
+    def train_cv(self, n_folds=5, max_rounds=3000, early_stopping_rounds=100, n_threads=None, parallel_folds=None):
+        """
+        K-fold cross validation with early stopping on AUC and histogram tree building
+        :param n_folds: Number of folds
+        :param max_rounds: Maximum boosting rounds of a fold
+        :param early_stopping_rounds: Stop a fold when its validation AUC did not improve for this many rounds
+        :param n_threads: Threads for all the folds (all cores by default)
+        :param parallel_folds: Folds trained at the same time (as many as cores allow by default)
+        :return: Report (also written to result/cv_report.json); sets the rounds used by Model.train
+        """
+        n_threads = n_threads or multiprocessing.cpu_count()
+        parallel_folds = min(parallel_folds or max(n_threads // 4, 1), n_folds)
+        params = dict(self.xgb_params(), tree_method='hist', nthread=max(n_threads // parallel_folds, 1))
+
+        start = time.time()
+        d_matrix, cached = self.train_d_matrix()
+        d_matrix_seconds = time.time() - start
+
+        labels = d_matrix.get_label()
+        folds = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=420).split(np.zeros(len(labels)),
+                                                                                          labels)
+
+        def train_fold(fold):
+            train_index, valid_index = fold
+            fold_start = time.time()
+            d_train = d_matrix.slice(train_index.tolist())
+            d_valid = d_matrix.slice(valid_index.tolist())
+            booster = xgb.train(params, d_train, num_boost_round=max_rounds, evals=[(d_valid, 'valid')],
+                                early_stopping_rounds=early_stopping_rounds, verbose_eval=False)
+            return {
+                'best_round': int(booster.best_iteration) + 1,
+                'auc': float(booster.best_score),
+                'seconds': time.time() - fold_start,
+            }
+
+        with PROFILER.stage('Model.train_cv', bidders=len(labels), folds=n_folds):
+            with ThreadPoolExecutor(max_workers=parallel_folds) as executor:
+                fold_reports = list(executor.map(train_fold, list(folds)))
+
+        self.num_boost_rounds = int(np.mean([fold['best_round'] for fold in fold_reports]))
+        report = {
+            'best_round': self.num_boost_rounds,
+            'mean_auc': float(np.mean([fold['auc'] for fold in fold_reports])),
+            'folds': fold_reports,
+            'd_matrix_cached': cached,
+            'd_matrix_seconds': d_matrix_seconds,
+            'threads': n_threads,
+            'parallel_folds': parallel_folds,
+        }
+        with open('result/cv_report.json', 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        return report
+
+    def param_search(self, n_candidates=27, min_rounds=50, max_rounds=1350, reduction=3, n_processes=None):
+        """
+        Search eta, max_depth, subsample, colsample_bytree, min_child_weight and the boosting rounds
+        by successive halving (see HalvingSearch), in parallel on one shared memory copy of the train matrix
+        :param n_candidates: Number of sampled candidates
+        :param min_rounds: Boosting rounds of the first rung
+        :param max_rounds: Maximum boosting rounds
+        :param reduction: Rounds factor and survivors divisor between two rungs
+        :param n_processes: Worker processes (all cores by default)
+        :return: Report (also written to SEARCH_REPORT_PATH); sets the params and rounds used by Model.train
+        """
+        answer = [int(value) for value in self.train_answer.values()]
+        train = self.select_rows(list(self.train_answer.keys()))
+        params = self.xgb_params()
+        del params['n_trees'], params['silent']
+        params['tree_method'] = 'hist'
+
+        search = HalvingSearch(params, n_candidates, min_rounds, max_rounds, reduction, n_processes)
+        with PROFILER.stage('Model.param_search', bidders=len(answer), candidates=n_candidates) as record:
+            report = search.run(train, answer, FeatureTransform(self.spec))
+            record['trials'] = len(report['trials'])
+        del train
+
+        report['data_set'] = self.keys['data_set']
+        report['features'] = list(self.spec.features)
+        with open(SEARCH_REPORT_PATH, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        self.tuned_params = report['best_params']
+        self.num_boost_rounds = report['best_rounds']
+        return report
+
+    def predict_rows(self, data):
+        """
+        Predict the probability of being a robot with the trained model
+        :param data: Sparse rows of the data set
+        :return: Array of probabilities
+        """
+        return self.model.predict(xgb.DMatrix(self.transform.transform(data)))
+
     def test(self):
         """
         Predict answer for test data
         :return: result.csv
         """
-        test = pd.DataFrame(data=self.train_data, index=self.test_data)
-        test = self.feature_engineering(test)
-        test = pd.DataFrame(data=test, columns=self.feature_engineering_column, index=self.test_data)
-        test = self.feature_selection(test)
-        test = self.poly.transform(np.nan_to_num(test))
-        d_matrix_test = xgb.DMatrix(test)
-        y_predicted = self.model.predict(d_matrix_test)
+        if self.test_data is None:
+            self.test_data = [test_id for test_id in pd.read_csv("data/test.csv", sep=',')['bidder_id']]
+        with PROFILER.stage('Model.test', bidders=len(self.test_data)):
+            y_predicted = self.predict_rows(self.select_rows(self.test_data))
 
         test_answer = pd.concat([pd.DataFrame(self.test_data), pd.DataFrame(y_predicted)], ignore_index=True, axis=1)
         final_result = pd.DataFrame(test_answer)
         final_result.to_csv('result/result.csv', index=False)
 
-    def tpot_search(self):
+    @staticmethod
+    def save_tpot_checkpoint(t_pot, generation, checkpoint_path):
+        """
+        Save the TPOT population after a generation (written to a temporary file then renamed)
+        """
+        StageCache.atomic_dump(checkpoint_path, {
+            'generation': generation,
+            'population': t_pot._pop,
+            'pareto_front': t_pot._pareto_front,
+            'evaluated_individuals': t_pot.evaluated_individuals_,
+        })
+
+    @staticmethod
+    def load_tpot_checkpoint(t_pot, checkpoint_path):
+        """
+        Restore the TPOT population of an interrupted search
+        :return: Number of generations already done
+        """
+        if not os.path.isfile(checkpoint_path):
+            return 0
+        # The DEAP classes of the individuals are created by _fit_init
+        t_pot._fit_init()
+        checkpoint = Model.load(checkpoint_path)
+        t_pot._pop = checkpoint['population']
+        t_pot._pareto_front = checkpoint['pareto_front']
+        t_pot.evaluated_individuals_ = checkpoint['evaluated_individuals']
+        print("Resuming TPOT search after generation {}".format(checkpoint['generation']))
+        return checkpoint['generation']
+
+    def tpot_search(self, generations=5, population_size=50, max_time_mins=None, n_jobs=-1,
+                    checkpoint_path='tpot_model/checkpoint.pkl', memory='tpot_model/cache'):
         """
-        Search model with TPOT
+        Search model with TPOT, one generation at a time so the population is checkpointed after each one
+        :param generations: Number of generations
+        :param population_size: Population size
+        :param max_time_mins: Wall clock budget of the whole search, split evenly across the generations
+        left to run (None for no limit)
+        :param n_jobs: Processes evaluating the candidates (-1 for all cores)
+        :param checkpoint_path: Population checkpoint, a search finding it resumes from it
+        :param memory: Directory caching the fitted transformers across candidates
         :return: tpot_pipeline.py
         """
-        train = pd.DataFrame(data=self.train_data, index=self.train_answer.keys()).values
+        # TPOT takes seconds to import, only the search needs it
+        import tpot
+        from tpot import TPOTClassifier
+
+        # The checkpoints use _pop, _pareto_front and _fit_init, which are not part of the TPOT API
+        version = tuple(int(part) for part in tpot.__version__.split('.')[:2])
+        if not TPOT_VERSIONS[0] <= version < TPOT_VERSIONS[1]:
+            raise ImportError("TPOT {} is not supported, install a version >= {} and < {}".format(
+                tpot.__version__, '.'.join(map(str, TPOT_VERSIONS[0])), '.'.join(map(str, TPOT_VERSIONS[1]))))
+
+        train = self.select_rows(list(self.train_answer.keys())).toarray()
         answer = [int(value) for value in self.train_answer.values()]
 
+        # Fixed split so that a resumed search keeps evaluating on the same data
         x_train, x_test, y_train, y_test = train_test_split(
                                                     train.astype(np.float64),
                                                     answer,
                                                     train_size=0.75,
-                                                    test_size=0.25
+                                                    test_size=0.25,
+                                                    random_state=420
         )
 
-        t_pot = TPOTClassifier(generations=5, population_size=50, verbosity=2)
-        t_pot.fit(x_train, y_train)
-        t_pot.export('tpot_model/tpot_pipeline.py')
+        t_pot = TPOTClassifier(generations=1, population_size=population_size, verbosity=2, n_jobs=n_jobs,
+                               warm_start=True, memory=memory, random_state=420)
+        done = self.load_tpot_checkpoint(t_pot, checkpoint_path)
+
+        deadline = time.time() + max_time_mins * 60 if max_time_mins else None
+        with PROFILER.stage('Model.tpot_search', generations=generations) as record:
+            for generation in range(done, generations):
+                if deadline is not None:
+                    remaining_mins = (deadline - time.time()) / 60.0
+                    if remaining_mins <= 0:
+                        print("TPOT time budget reached after generation {}".format(generation))
+                        break
+                    # Fractional minutes, rounding up to a whole minute would overrun the deadline
+                    t_pot.max_time_mins = remaining_mins / (generations - generation)
+                t_pot.fit(x_train, y_train)
+                self.save_tpot_checkpoint(t_pot, generation + 1, checkpoint_path)
+                record['generations_done'] = generation + 1
+
+        if hasattr(t_pot, 'fitted_pipeline_'):
+            t_pot.export('tpot_model/tpot_pipeline.py')
+        if record.get('generations_done', done) >= generations and os.path.isfile(checkpoint_path):
+            os.remove(checkpoint_path)
@@ -0,0 +1,182 @@
+"""
+Stage-level instrumentation of the pipeline
+"""
+import collections
+import contextlib
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of the process (VmHWM, reset by reset_peak_rss), in MB
+    """
+    try:
+        with open('/proc/self/status') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident memory so it can be measured stage by stage (Linux only)
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except IOError:
+        pass
+
+
+class StackSampler(object):
+    """
+    Sample the stack of a thread at a fixed interval and count the functions seen on it
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.Counter()
+        self.nb_samples = 0
+        self.running = False
+        self.thread = None
+
+    def sample(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            self.nb_samples += 1
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                name = '{}:{}'.format(os.path.basename(code.co_filename), code.co_name)
+                if name not in seen:
+                    self.counts[name] += 1
+                    seen.add(name)
+                frame = frame.f_back
+            time.sleep(self.interval)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.sample)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, top=20):
+        """
+        :return: The most sampled functions with their share of the samples
+        """
+        self.running = False
+        self.thread.join()
+        total = float(max(self.nb_samples, 1))
+        return [[name, count / total] for name, count in self.counts.most_common(top)]
+
+
+class Profiler(object):
+    """
+    Record the wall time, throughput, peak memory and cache hits of each stage of a run,
+    and write them as a json report
+    """
+
+    def __init__(self, report_dir="result/profiles"):
+        self.report_dir = report_dir
+        self.sampling = False
+        self.sample_interval = 0.005
+        self.hooks_enabled = False
+        self.stages = []
+        self.counters = collections.Counter()
+        self.hooks = collections.defaultdict(lambda: {'calls': 0, 'seconds': 0.0})
+        self.start_time = time.time()
+
+    def enable(self, sampling=False, hooks=False, sample_interval=0.005):
+        """
+        :param sampling: Sample the stack during each stage
+        :param hooks: Time the functions decorated with Profiler.hook (per-bidder functions)
+        :param sample_interval: Seconds between two stack samples
+        """
+        self.sampling = sampling
+        self.hooks_enabled = hooks
+        self.sample_interval = sample_interval
+
+    @contextlib.contextmanager
+    def stage(self, name, **measures):
+        """
+        Measure a stage; the caller can add measures (rows, bidders, cache_hit...) to the yielded record
+        :param name: Stage name
+        """
+        record = {'stage': name}
+        record.update(measures)
+        sampler = None
+        if self.sampling:
+            sampler = StackSampler(threading.current_thread().ident, self.sample_interval)
+            sampler.start()
+        reset_peak_rss()
+        start = time.time()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.time() - start
+            record['peak_rss_mb'] = peak_rss_mb()
+            for unit in ['rows', 'bidders']:
+                if record.get(unit):
+                    record[unit + '_per_second'] = record[unit] / max(record['seconds'], 1e-9)
+            if sampler is not None:
+                record['samples'] = sampler.stop()
+            self.stages.append(record)
+            print("{:<28} {:>9.2f}s {:>9.1f} MB".format(name, record['seconds'], record['peak_rss_mb']))
+
+    def increment(self, counter, value=1):
+        self.counters[counter] += value
+
+    def hook(self, function):
+        """
+        Decorator timing the calls of a function when the hooks are enabled
+        """
+        name = function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not self.hooks_enabled:
+                return function(*args, **kwargs)
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.hooks[name]['calls'] += 1
+                self.hooks[name]['seconds'] += time.time() - start
+        return wrapper
+
+    def report(self):
+        return {
+            'start_time': self.start_time,
+            'seconds': time.time() - self.start_time,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            'stages': self.stages,
+            'counters': dict(self.counters),
+            'hooks': dict(self.hooks),
+        }
+
+    def write_report(self):
+        """
+        Write the json report of the run
+        :return: Report path
+        """
+        if not os.path.isdir(self.report_dir):
+            os.makedirs(self.report_dir)
+        report_path = os.path.join(self.report_dir, 'profile_{}.json'.format(
+            time.strftime('%Y%m%d_%H%M%S', time.localtime(self.start_time))))
+        with open(report_path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+        return report_path
+
+
+# Profiler shared by Load, Extract and Model
+PROFILER = Profiler()
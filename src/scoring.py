@@ -0,0 +1,201 @@
+"""
+Online scoring of bidders
+"""
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue, Empty
+
+import numpy as np
+import pandas as pd
+
+from src.feature_engine import AUCTION_CONTEXT_COLUMNS, FeatureEngine
+from src.load_data import BIDS_MISSING_VALUES, BIDS_STRING_COLUMNS
+
+
+class Scorer(object):
+    """
+    Score raw bids with a trained Model: features are computed by the FeatureEngine used by Extract,
+    then go through the fitted feature encoder, feature transform and booster of the model
+    """
+
+    def __init__(self, model):
+        """
+        :param model: Trained model
+        :type model: Model
+        """
+        # A request only holds the bids of its own bidders, not the auctions they bid in
+        context_columns = [column for column in model.spec.raw_columns() if column in AUCTION_CONTEXT_COLUMNS]
+        if context_columns:
+            raise ValueError("Cross-bidder features can not be scored online: {}".format(context_columns))
+        self.model = model
+        self.mapper = model.mapper or model.train_data['mapper']
+
+    @staticmethod
+    def bids_frame(bids):
+        """
+        Bids dataframe with the types and missing values of Load
+        :param bids: List of bid dicts (bids.csv columns) or dataframe
+        """
+        bids = pd.DataFrame(bids)
+        for column in BIDS_STRING_COLUMNS:
+            bids[column] = bids[column].fillna(BIDS_MISSING_VALUES[column]).astype(str)
+        bids['time'] = bids['time'].fillna(BIDS_MISSING_VALUES['time']).astype(np.int64)
+        return bids
+
+    def score(self, bids):
+        """
+        Probability of being a robot of each bidder of the bids
+        :param bids: List of bid dicts (bids.csv columns) or dataframe
+        :return: Dict bidder_id -> probability
+        """
+        bids = self.bids_frame(bids)
+        if not len(bids):
+            return {}
+        columns = self.model.spec.raw_columns()
+        bidder_ids, rows = FeatureEngine.from_frame(bids).compute(columns)
+        data = pd.DataFrame(rows, index=bidder_ids, columns=columns)
+        data.fillna(0.0, inplace=True)
+        probabilities = self.model.predict_rows(self.mapper.transform(data))
+        return {bidder_id: float(probability) for bidder_id, probability in zip(bidder_ids, probabilities)}
+
+
+class MicroBatcher(object):
+    """
+    Gather the concurrent scoring requests in a worker thread and score them in a single batch
+    """
+
+    def __init__(self, scorer, max_batch_size=64, max_wait=0.002, latency_window=10000):
+        """
+        :param scorer: Scorer
+        :param max_batch_size: Maximum number of requests scored together
+        :param max_wait: Seconds to wait for other requests once one has arrived
+        :param latency_window: Number of recent latencies kept for the report
+        """
+        self.scorer = scorer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = Queue()
+        self.latencies = deque(maxlen=latency_window)
+        self.batch_sizes = deque(maxlen=latency_window)
+        self.stats_lock = threading.Lock()
+        self.worker = threading.Thread(target=self.run)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self.requests.get(timeout=max(deadline - time.time(), 0)))
+                except Empty:
+                    break
+            self.score_batch(batch)
+
+    def score_batch(self, batch):
+        """
+        Score the bids of several requests at once
+        :param batch: List of [bids dataframe, event, result] requests
+        """
+        try:
+            # Prefix the bidder ids with the request number so that requests about a same bidder stay apart
+            frames = []
+            for number, request in enumerate(batch):
+                frame = request[0].copy()
+                frame['bidder_id'] = '{}:'.format(number) + frame['bidder_id']
+                frames.append(frame)
+            scores = self.scorer.score(pd.concat(frames, ignore_index=True))
+            for number, request in enumerate(batch):
+                request[2] = {bidder_id: scores['{}:{}'.format(number, bidder_id)]
+                              for bidder_id in request[0]['bidder_id'].unique()}
+        except Exception as error:
+            for request in batch:
+                request[2] = error
+        with self.stats_lock:
+            self.batch_sizes.append(len(batch))
+        for request in batch:
+            request[1].set()
+
+    def score(self, bids):
+        """
+        Score bids, blocking until their batch is done
+        :param bids: List of bid dicts (bids.csv columns) or dataframe
+        :return: Dict bidder_id -> probability
+        """
+        start = time.time()
+        request = [Scorer.bids_frame(bids), threading.Event(), None]
+        self.requests.put(request)
+        request[1].wait()
+        with self.stats_lock:
+            self.latencies.append(time.time() - start)
+        if isinstance(request[2], Exception):
+            raise request[2]
+        return request[2]
+
+    def latency_report(self):
+        """
+        p50/p99 latency (milliseconds) of the recent requests
+        """
+        with self.stats_lock:
+            latencies = np.array(self.latencies) * 1000
+            batch_sizes = np.array(self.batch_sizes)
+        if not len(latencies):
+            return {'requests': 0}
+        return {
+            'requests': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'mean_batch_size': float(np.mean(batch_sizes)),
+        }
+
+
+def serve(batcher, host="127.0.0.1", port=8080):
+    """
+    Local HTTP front end: POST /score with {"bids": [...]} returns {bidder_id: probability},
+    GET /stats returns the latency report
+    :param batcher: MicroBatcher
+    """
+
+    class ScoringHandler(BaseHTTPRequestHandler):
+
+        def send_json(self, code, content):
+            body = json.dumps(content).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self.send_json(200, batcher.latency_report())
+            else:
+                self.send_json(404, {'error': 'unknown path'})
+
+        def do_POST(self):
+            if self.path != '/score':
+                self.send_json(404, {'error': 'unknown path'})
+                return
+            try:
+                content = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+                bids = Scorer.bids_frame(content['bids'])
+            except Exception as error:
+                # Malformed body: not json, no bids list, missing columns or bad values
+                self.send_json(400, {'error': '{}: {}'.format(type(error).__name__, error)})
+                return
+            try:
+                self.send_json(200, batcher.score(bids))
+            except Exception as error:
+                self.send_json(500, {'error': '{}: {}'.format(type(error).__name__, error)})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), ScoringHandler)
+    server.daemon_threads = True
+    print("Scoring on http://{}:{}/score".format(host, port))
+    server.serve_forever()
@@ -0,0 +1,181 @@
+"""
+Hyperparameter search of the booster by successive halving on the boosting rounds
+"""
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import xgboost as xgb
+from scipy import sparse
+
+
+# Values tried for each parameter
+PARAM_SPACE = {
+    'eta': [0.02, 0.04, 0.06, 0.1, 0.2],
+    'max_depth': [3, 4, 5, 6, 8],
+    'subsample': [0.6, 0.75, 0.89, 1.0],
+    'colsample_bytree': [0.5, 0.75, 1.0],
+    'min_child_weight': [1, 3, 10],
+}
+
+# Train and validation matrices of a worker process, built by attach_matrix
+WORKER_DATA = {}
+
+
+def attach_matrix(shared_name, shape, labels, nb_train, nthread):
+    """
+    Pool initializer: view the shared train matrix (train rows first, then validation rows)
+    and build the xgboost matrices of the worker from it once, for all its trials
+    """
+    shared = shared_memory.SharedMemory(name=shared_name)
+    matrix = np.ndarray(shape, dtype=np.float32, buffer=shared.buf)
+    d_train = xgb.QuantileDMatrix(matrix[:nb_train], labels[:nb_train], nthread=nthread)
+    WORKER_DATA['shared'] = shared
+    WORKER_DATA['d_train'] = d_train
+    WORKER_DATA['d_valid'] = xgb.QuantileDMatrix(matrix[nb_train:], labels[nb_train:], ref=d_train,
+                                                 nthread=nthread)
+
+
+def run_trial(trial):
+    """
+    Train a candidate up to a number of rounds (run in a worker process), going on from its booster
+    of the previous rung if any
+    :param trial: (candidate number, params, rounds, raw booster of the previous rung or None, its rounds)
+    :return: Trial report, with the raw booster under 'model'
+    """
+    number, params, rounds, model, done_rounds = trial
+    start = time.time()
+    evals_result = {}
+    booster = xgb.train(params, WORKER_DATA['d_train'], num_boost_round=rounds - done_rounds,
+                        evals=[(WORKER_DATA['d_valid'], 'valid')], evals_result=evals_result, verbose_eval=False,
+                        xgb_model=model)
+    return {
+        'candidate': number,
+        'rounds': rounds,
+        'trained_rounds': rounds - done_rounds,
+        'auc': float(evals_result['valid']['auc'][-1]),
+        'seconds': time.time() - start,
+        'model': booster.save_raw(),
+    }
+
+
+class HalvingSearch(object):
+    """
+    Successive halving: every candidate is trained for a few rounds, the best 1 / reduction of them
+    go on up to reduction times more rounds (from their booster of the previous rung), until max_rounds
+    or a single candidate is left.
+    The candidates run in a process pool reading one shared memory copy of the expanded train matrix.
+    """
+
+    def __init__(self, base_params, n_candidates=27, min_rounds=50, max_rounds=1350, reduction=3, n_processes=None,
+                 random_state=420):
+        """
+        :param base_params: Booster params shared by the candidates (objective, eval_metric, base_score...)
+        :param n_candidates: Number of sampled candidates, the base params being the first one
+        :param min_rounds: Boosting rounds of the first rung
+        :param max_rounds: Maximum boosting rounds of a candidate
+        :param reduction: Rounds factor and survivors divisor between two rungs
+        :param n_processes: Worker processes (all cores by default)
+        :param random_state: Random state of the candidates sampling
+        """
+        self.base_params = base_params
+        self.n_candidates = n_candidates
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.reduction = reduction
+        self.n_processes = n_processes or multiprocessing.cpu_count()
+        self.random = np.random.RandomState(random_state)
+
+    def candidates(self):
+        """
+        :return: List of candidate params, the base params first
+        """
+        # xgboost defaults of the searched params the base params do not set
+        base_params = {'colsample_bytree': 1.0, 'min_child_weight': 1}
+        base_params.update(self.base_params)
+        candidates = [base_params]
+        while len(candidates) < self.n_candidates:
+            params = dict(self.base_params)
+            for name, values in sorted(PARAM_SPACE.items()):
+                params[name] = values[self.random.randint(len(values))]
+            if params not in candidates:
+                candidates.append(params)
+        return candidates
+
+    def run(self, data, labels, transform, valid_size=0.25):
+        """
+        :param data: Sparse rows of the data set
+        :param labels: Label of each row
+        :param transform: Feature transform, fitted here on the train rows only so that the PCA
+        does not see the rows scoring the candidates
+        :type transform: FeatureTransform
+        :param valid_size: Share of the rows (stratified) used to score the candidates
+        :return: Report with the best params and rounds, the throughput and every trial
+        """
+        data = sparse.csr_matrix(data)
+        labels = np.asarray(labels, dtype=np.float32)
+        valid = np.zeros(len(labels), dtype=bool)
+        for label in np.unique(labels):
+            rows = np.flatnonzero(labels == label)
+            valid[self.random.choice(rows, int(round(len(rows) * valid_size)), replace=False)] = True
+        order = np.concatenate((np.flatnonzero(~valid), np.flatnonzero(valid)))
+        transform.fit(data[~valid], labels[~valid])
+
+        candidates = self.candidates()
+        nthread = max(multiprocessing.cpu_count() // self.n_processes, 1)
+        shared = shared_memory.SharedMemory(create=True, size=max(len(order) * transform.n_outputs * 4, 1))
+        start = time.time()
+        trials = []
+        try:
+            shared_matrix = np.ndarray((len(order), transform.n_outputs), dtype=np.float32, buffer=shared.buf)
+            transform.transform(data[order], out=shared_matrix)
+            pool = multiprocessing.Pool(self.n_processes, initializer=attach_matrix,
+                                        initargs=(shared.name, shared_matrix.shape, labels[order],
+                                                  int((~valid).sum()), nthread))
+            try:
+                survivors = list(range(len(candidates)))
+                # Booster of each survivor at the end of the previous rung, and its rounds
+                models = {}
+                done_rounds = 0
+                rounds = self.min_rounds
+                rung_number = 0
+                while True:
+                    rung = pool.map(run_trial, [(number, dict(candidates[number], nthread=nthread), rounds,
+                                                 models.get(number), done_rounds) for number in survivors])
+                    models = {}
+                    for trial in rung:
+                        models[trial['candidate']] = trial.pop('model')
+                        params = candidates[trial['candidate']]
+                        trial['rung'] = rung_number
+                        trial['params'] = {name: params[name] for name in sorted(PARAM_SPACE)}
+                    trials.extend(rung)
+                    rung.sort(key=lambda trial: trial['auc'], reverse=True)
+                    survivors = [trial['candidate'] for trial in rung[:max(len(rung) // self.reduction, 1)]]
+                    if len(rung) == 1 or rounds * self.reduction > self.max_rounds:
+                        best = rung[0]
+                        break
+                    models = {number: models[number] for number in survivors}
+                    done_rounds = rounds
+                    rounds *= self.reduction
+                    rung_number += 1
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            shared.close()
+            shared.unlink()
+
+        seconds = time.time() - start
+        boosting_rounds = sum(trial['trained_rounds'] for trial in trials)
+        return {
+            'best_params': best['params'],
+            'best_rounds': best['rounds'],
+            'best_auc': best['auc'],
+            'candidates': len(candidates),
+            'processes': self.n_processes,
+            'seconds': seconds,
+            'trials_per_second': len(trials) / max(seconds, 1e-9),
+            'rounds_per_second': boosting_rounds / max(seconds, 1e-9),
+            'trials': trials,
+        }
@@ -0,0 +1,41 @@
+"""
+Streaming training input: the sparse train rows are expanded batch by batch while xgboost builds its matrix
+"""
+import numpy as np
+import xgboost as xgb
+from scipy import sparse
+
+
+class FeatureBatches(xgb.DataIter):
+    """
+    xgboost data iterator slicing the sparse train rows in memory and expanding one slice at a time with
+    the fitted FeatureTransform, so only one expanded batch is in memory while the DMatrix is built
+    """
+
+    def __init__(self, data, labels, transform, batch_rows=65536, cache_prefix=None):
+        """
+        :param data: Sparse rows of the data set
+        :param labels: Label of each row
+        :param transform: Fitted feature transform
+        :type transform: FeatureTransform
+        :param batch_rows: Rows per batch, the peak memory grows with it
+        :param cache_prefix: Prefix of the xgboost external memory cache (None for a QuantileDMatrix)
+        """
+        self.data = sparse.csr_matrix(data, dtype=np.float32)
+        self.labels = np.asarray(labels, dtype=np.float32)
+        self.transform = transform
+        self.batch_rows = batch_rows
+        self.position = 0
+        super(FeatureBatches, self).__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self.position >= self.data.shape[0]:
+            return 0
+        stop = min(self.position + self.batch_rows, self.data.shape[0])
+        input_data(data=self.transform.transform(self.data[self.position:stop]),
+                   label=self.labels[self.position:stop])
+        self.position = stop
+        return 1
+
+    def reset(self):
+        self.position = 0
@@ -0,0 +1,132 @@
+"""
+Synthetic bids generator
+"""
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class SyntheticBids(object):
+    """
+    Generate bids.csv, train.csv and test.csv with the schema expected by Load:
+    a few robots with huge bid counts, long tail ips and urls, time ordered bids
+    """
+
+    def __init__(self, nb_rows=1000000, nb_bidders=None, robot_ratio=0.05, chunk_rows=1000000, seed=420):
+        """
+        :param nb_rows: Number of bids
+        :param nb_bidders: Number of bidders (about one per 1,150 bids like the real data by default)
+        :param robot_ratio: Share of robots among the bidders
+        :param chunk_rows: Bids generated and written at once
+        :param seed: Random seed
+        """
+        self.nb_rows = nb_rows
+        self.nb_bidders = nb_bidders or max(nb_rows // 1150, 100)
+        self.robot_ratio = robot_ratio
+        self.chunk_rows = chunk_rows
+        self.random = np.random.RandomState(seed)
+
+        self.nb_auctions = max(nb_rows // 500, 50)
+        self.nb_devices = max(nb_rows // 1000, 20)
+        self.nb_ips = max(nb_rows // 3, 100)
+        self.nb_urls = max(nb_rows // 4, 100)
+        self.nb_countries = 200
+        self.merchandises = np.array(['mobile', 'jewelry', 'home goods', 'sporting goods', 'auto parts',
+                                      'office equipment', 'computers', 'books and music', 'furniture', 'clothing'],
+                                     dtype=object)
+
+        self.bidder_ids = np.array([self.hex_id('bidder', i) + 'b' * 5 for i in range(self.nb_bidders)], dtype=object)
+        self.robots = self.random.rand(self.nb_bidders) < self.robot_ratio
+
+        # Bid count weights: log-normal for humans, a few orders of magnitude more for robots
+        weights = self.random.lognormal(mean=0.0, sigma=1.5, size=self.nb_bidders)
+        weights[self.robots] *= self.random.lognormal(mean=4.0, sigma=1.0, size=int(self.robots.sum()))
+        self.bidder_weights = weights / weights.sum()
+        self.bidder_merchandise = self.random.randint(0, len(self.merchandises), self.nb_bidders)
+
+    @staticmethod
+    def hex_id(prefix, number):
+        return hashlib.md5('{}{}'.format(prefix, number).encode('utf-8')).hexdigest()
+
+    def skewed(self, nb_values, skew, size):
+        """
+        Codes in [0, nb_values) with a power law concentrated on the first ones
+        """
+        return np.minimum((nb_values * self.random.rand(size) ** skew).astype(np.int64), nb_values - 1)
+
+    def chunk(self, first_row, size, start_time):
+        """
+        Generate a chunk of bids
+        :return: Bids dataframe, time of the last bid
+        """
+        bidder = self.random.choice(self.nb_bidders, size=size, p=self.bidder_weights)
+        robot = self.robots[bidder]
+
+        # Robots bid from many ips and urls, humans from a few
+        ip = np.where(robot, self.random.randint(0, self.nb_ips, size), self.skewed(self.nb_ips, 3.0, size))
+        url = np.where(robot, self.skewed(self.nb_urls, 2.0, size), self.skewed(self.nb_urls, 6.0, size))
+        merchandise = np.where(self.random.rand(size) < 0.98, self.bidder_merchandise[bidder],
+                               self.random.randint(0, len(self.merchandises), size))
+        time = start_time + np.cumsum(self.random.exponential(5e7, size).astype(np.int64) + 1)
+
+        bids = pd.DataFrame({
+            'bid_id': np.arange(first_row, first_row + size),
+            'bidder_id': self.bidder_ids[bidder],
+            'auction': pd.Series(self.skewed(self.nb_auctions, 2.0, size)).map('a{:05x}'.format).values,
+            'merchandise': self.merchandises[merchandise],
+            'device': pd.Series(self.skewed(self.nb_devices, 2.5, size) + 1).map('phone{}'.format).values,
+            'time': time,
+            'country': pd.Series(self.skewed(self.nb_countries, 3.0, size)).map(
+                lambda code: chr(97 + code // 26 % 26) + chr(97 + code % 26)).values,
+            'ip': pd.Series(ip).map(
+                lambda code: '{}.{}.{}.{}'.format(code >> 24 & 255, code >> 16 & 255, code >> 8 & 255,
+                                                  code & 255)).values,
+            'url': pd.Series(url).map('{:013x}'.format).values,
+        })
+        # Some bids have no country, like in the real data
+        bids.loc[self.random.rand(size) < 0.001, 'country'] = np.nan
+        return bids, int(time[-1])
+
+    def write(self, data_dir="data"):
+        """
+        Write bids.csv, train.csv and test.csv
+        :param data_dir: Output directory
+        """
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+
+        start_time = 9631916842105263
+        with open(os.path.join(data_dir, 'bids.csv'), 'w') as bids_file:
+            for first_row in range(0, self.nb_rows, self.chunk_rows):
+                size = min(self.chunk_rows, self.nb_rows - first_row)
+                bids, start_time = self.chunk(first_row, size, start_time)
+                bids.to_csv(bids_file, index=False, header=first_row == 0)
+                print("{} / {} bids".format(first_row + size, self.nb_rows))
+
+        # Two thirds of the bidders in train, the others in test, plus a few bidders without bids
+        extra_ids = np.array([self.hex_id('idle', i) + 'i' * 5 for i in range(self.nb_bidders // 50)],
+                             dtype=object)
+        bidder_ids = np.concatenate((self.bidder_ids, extra_ids))
+        outcome = np.concatenate((self.robots, np.zeros(len(extra_ids), dtype=bool))).astype(np.float64)
+        bidders = pd.DataFrame({
+            'bidder_id': bidder_ids,
+            'payment_account': [self.hex_id('account', i) + 'a' * 5 for i in range(len(bidder_ids))],
+            'address': [self.hex_id('address', i) + 'd' * 5 for i in range(len(bidder_ids))],
+            'outcome': outcome,
+        })
+        in_train = self.random.rand(len(bidders)) < 2 / 3.0
+        bidders[in_train].to_csv(os.path.join(data_dir, 'train.csv'), index=False)
+        bidders[~in_train].drop('outcome', axis=1).to_csv(os.path.join(data_dir, 'test.csv'), index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate synthetic bids, train and test files")
+    parser.add_argument('--rows', type=int, default=1000000, help="number of bids")
+    parser.add_argument('--bidders', type=int, default=None, help="number of bidders")
+    parser.add_argument('--seed', type=int, default=420)
+    parser.add_argument('--out', default="data", help="output directory")
+    arguments = parser.parse_args()
+    SyntheticBids(arguments.rows, arguments.bidders, seed=arguments.seed).write(arguments.out)
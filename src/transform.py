@@ -0,0 +1,100 @@
+"""
+Feature transform of the model input
+"""
+import numpy as np
+from scipy import sparse
+
+from src.decomposition import SparseInputPCA
+
+
+class FeatureTransform(object):
+    """
+    Fitted transform from the data set rows to the booster input, in float32:
+    PCA projection, ordering of the features as in the FeatureSpec, NaN handling
+    and degree-2 polynomial expansion (same layout as PolynomialFeatures(2)).
+
+    Rows are processed in batches written directly into a preallocated output,
+    so the memory used on top of the output only depends on the batch size.
+    """
+
+    def __init__(self, spec, batch_size=4096, random_state=420):
+        """
+        :param spec: Feature specification
+        :type spec: FeatureSpec
+        :param batch_size: Rows transformed at once
+        :param random_state: Random state of the PCA
+        """
+        self.features = list(spec.features)
+        self.batch_size = batch_size
+        self.random_state = random_state
+        self.n_components = len(spec.pca_features)
+        self.pca = None
+        self.components = None
+        self.projected_mean = None
+
+        # Position of each data set column and of each PCA component among the ordered features
+        self.data_columns = np.array([self.features.index(feature) for feature in spec.data_features],
+                                     dtype=np.int64)
+        self.pca_columns = np.array([self.features.index(feature) for feature in spec.pca_features], dtype=np.int64)
+
+    @property
+    def n_features(self):
+        return len(self.features)
+
+    @property
+    def n_outputs(self):
+        """
+        Bias, linear terms, then the products x_i * x_j for i <= j
+        """
+        return 1 + self.n_features + self.n_features * (self.n_features + 1) // 2
+
+    def fit(self, data, answer=None):
+        """
+        Fit the PCA on the data set rows
+        :param data: Sparse rows with the spec data features as columns (see FeatureEncoder)
+        :param answer: Ignored, kept for the PCA interface
+        """
+        if self.n_components:
+            self.pca = SparseInputPCA(n_components=self.n_components, random_state=self.random_state)
+            self.pca.fit(data, answer)
+            self.components = np.ascontiguousarray(self.pca.components_.T, dtype=np.float32)
+            self.projected_mean = self.pca.mean_.dot(self.pca.components_.T).astype(np.float32)
+        return self
+
+    def transform_batch(self, rows, out):
+        """
+        Transform a batch of rows
+        :param rows: Float32 CSR rows
+        :param out: Float32 output rows (len(rows), n_outputs)
+        """
+        n_features = self.n_features
+        linear = out[:, 1:n_features + 1]
+        out[:, 0] = 1.0
+        linear[:, self.data_columns] = rows.toarray()
+        if self.n_components:
+            linear[:, self.pca_columns] = rows.dot(self.components) - self.projected_mean
+        np.nan_to_num(linear, copy=False)
+
+        offset = n_features + 1
+        for i in range(n_features):
+            np.multiply(linear[:, i:i + 1], linear[:, i:], out=out[:, offset:offset + n_features - i])
+            offset += n_features - i
+        return out
+
+    def transform(self, data, out=None):
+        """
+        :param data: Sparse (or dense) rows with the spec data features as columns
+        :param out: Preallocated float32 output (n_rows, n_outputs), allocated here by default
+        :return: Float32 array (n_rows, n_outputs)
+        """
+        data = sparse.csr_matrix(data, dtype=np.float32)
+        n_rows = data.shape[0]
+        if out is None:
+            out = np.empty((n_rows, self.n_outputs), dtype=np.float32)
+        for start in range(0, n_rows, self.batch_size):
+            stop = min(start + self.batch_size, n_rows)
+            self.transform_batch(data[start:stop], out[start:stop])
+        return out
+
+    def fit_transform(self, data, answer=None):
+        return self.fit(data, answer).transform(data)
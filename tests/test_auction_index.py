@@ -0,0 +1,84 @@
+"""
+Cross-bidder features of the AuctionIndex against a naive per-auction loop
+"""
+import numpy as np
+import pandas as pd
+
+from src.feature_engine import AUCTION_CONTEXT_COLUMNS, AuctionIndex, FeatureEngine
+
+
+def fixture_bids():
+    """
+    Auction u1 has three bids at the same time (ordered by file row) and runs of consecutive bids
+    of a same bidder, u2 a time tie between two bidders, u3 a single bid without competitor
+    """
+    return pd.DataFrame({
+        'bidder_id': ['a', 'b', 'a', 'a', 'c', 'b', 'c', 'a', 'a', 'b', 'd'],
+        'auction': ['u1', 'u1', 'u1', 'u1', 'u2', 'u1', 'u1', 'u2', 'u2', 'u2', 'u3'],
+        'merchandise': ['books'] * 11,
+        'device': ['d1'] * 11,
+        'time': np.array([10, 10, 20, 30, 5, 10, 40, 5, 7, 50, 100], dtype=np.int64),
+        'country': ['fr'] * 11,
+        'ip': ['x', 'y', 'x', 'x', 'z', 'x', 'z', 'x', 'x', 'y', 'w'],
+        'url': ['w1'] * 11,
+    })
+
+
+def naive_auction_context(bids):
+    """
+    The AUCTION_CONTEXT_COLUMNS of each bidder, one auction and one bid at a time
+    """
+    bids = bids.assign(file_row=np.arange(len(bids)))
+    bidder_ids = sorted(bids['bidder_id'].unique())
+    elapsed = {bidder_id: [] for bidder_id in bidder_ids}
+    ranks = {bidder_id: [] for bidder_id in bidder_ids}
+    auction_sizes = {bidder_id: [] for bidder_id in bidder_ids}
+    last_bids = {bidder_id: 0 for bidder_id in bidder_ids}
+    for _, auction_bids in bids.groupby('auction'):
+        auction_bids = auction_bids.sort_values(['time', 'file_row'])
+        bidders = auction_bids['bidder_id'].tolist()
+        times = auction_bids['time'].tolist()
+        for i, bidder_id in enumerate(bidders):
+            previous = i - 1
+            while previous >= 0 and bidders[previous] == bidder_id:
+                previous -= 1
+            if previous >= 0:
+                elapsed[bidder_id].append(times[i] - times[previous])
+            ranks[bidder_id].append(i / float(max(len(bidders) - 1, 1)))
+        last_bids[bidders[-1]] += 1
+        for bidder_id in set(bidders):
+            auction_sizes[bidder_id].append(len(set(bidders)))
+
+    ip_bidders = bids.groupby('ip')['bidder_id'].nunique()
+    rows = []
+    for bidder_id in bidder_ids:
+        ips = bids.loc[bids['bidder_id'] == bidder_id, 'ip']
+        rows.append([
+            np.mean(elapsed[bidder_id]) if elapsed[bidder_id] else np.nan,
+            np.min(elapsed[bidder_id]) if elapsed[bidder_id] else np.nan,
+            last_bids[bidder_id] / float(len(auction_sizes[bidder_id])),
+            np.mean(ranks[bidder_id]),
+            np.mean(auction_sizes[bidder_id]),
+            np.mean(ip_bidders[ips].values),
+        ])
+    return bidder_ids, rows
+
+
+def test_time_ties_are_broken_by_file_row():
+    bids = fixture_bids()
+    auction = pd.factorize(bids['auction'])[0]
+    bidder = pd.factorize(bids['bidder_id'], sort=True)[0]
+    index = AuctionIndex(auction, bids['time'].values, bidder, np.arange(len(bids)))
+    assert index.order[:6].tolist() == [0, 1, 5, 2, 3, 6]
+    # The bid before a run of a same bidder is the competitor's one
+    assert np.allclose(index.time_since_competitor()[:6], [np.nan, 0, 0, 10, 20, 10], equal_nan=True)
+
+
+def test_engine_equals_naive_loop():
+    bids = fixture_bids()
+    naive_ids, naive_rows = naive_auction_context(bids)
+    engine_ids, engine_rows = FeatureEngine.from_frame(bids).compute(AUCTION_CONTEXT_COLUMNS)
+
+    assert list(engine_ids) == naive_ids
+    assert np.allclose(np.array(engine_rows, dtype=np.float64), np.array(naive_rows, dtype=np.float64),
+                       equal_nan=True)
@@ -0,0 +1,55 @@
+"""
+FeatureEngine against the per-bidder loop of Extract on a small fixture
+"""
+import numpy as np
+import pandas as pd
+
+from src.extract_features import Extract
+from src.feature_engine import COLUMN_NAMES, FeatureEngine
+
+
+def fixture_bids():
+    """
+    Two bidders whose ips and auctions are all tied, seen in a different order than in the whole file
+    """
+    return pd.DataFrame({
+        'bidder_id': ['a', 'b', 'b', 'a', 'b', 'a'],
+        'auction': ['u1', 'u2', 'u1', 'u2', 'u1', 'u1'],
+        'merchandise': ['books', 'books', 'books', 'books', 'books', 'books'],
+        'device': ['d1', 'd2', 'd2', 'd1', 'd3', 'd1'],
+        'time': np.array([10, 20, 35, 45, 60, 80], dtype=np.int64),
+        'country': ['fr', 'us', 'fr', 'fr', 'us', 'us'],
+        'ip': ['x', 'y', 'x', 'y', 'z', 'z'],
+        'url': ['w1', 'w1', 'w2', 'w2', 'w1', 'w1'],
+    })
+
+
+def test_arg_max_ties_go_to_first_value_of_the_bidder():
+    bidder_ids, rows = FeatureEngine.from_frame(fixture_bids()).compute(['arg_max_ip', 'arg_max_country', 'bid_nb'])
+    assert bidder_ids == ['a', 'b']
+    assert rows == [['x', 'fr', 3.0], ['y', 'us', 3.0]]
+
+
+def test_engine_equals_per_bidder_loop():
+    bids = fixture_bids()
+    loop_ids, loop_rows = Extract.__new__(Extract).compute_features_by_bidder(bids)
+    engine_ids, engine_rows = FeatureEngine.from_frame(bids).compute()
+
+    assert list(loop_ids) == list(engine_ids)
+    loop_data = pd.DataFrame(loop_rows, columns=COLUMN_NAMES)
+    engine_data = pd.DataFrame(engine_rows, columns=COLUMN_NAMES)
+    for column in COLUMN_NAMES:
+        if column.startswith('arg_max'):
+            # Only ties may be broken differently: value_counts does not define their order
+            different = (loop_data[column] != engine_data[column]).values
+            ties = Extract.arg_max_ties(bids, np.asarray(loop_ids)[different], column[len('arg_max_'):],
+                                        loop_data[column].values[different], engine_data[column].values[different])
+            assert ties.all(), column
+        else:
+            assert np.allclose(loop_data[column].values, engine_data[column].values, rtol=1e-9), column
+
+
+def test_only_equal_counts_are_ties():
+    bids = fixture_bids()
+    ties = Extract.arg_max_ties(bids, ['a', 'b', 'b'], 'device', ['d1', 'd2', 'd3'], ['d1', 'd3', 'd2'])
+    assert ties.tolist() == [True, False, False]
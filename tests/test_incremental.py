@@ -0,0 +1,68 @@
+"""
+Summaries folded in two halves against a full FeatureEngine run
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.feature_engine import COLUMN_NAMES, FeatureEngine
+from src.incremental import IncrementalFeatures, QuantileSketch
+
+PERCENTILE_COLUMNS = ['time_interval_25', 'time_interval_50', 'time_interval_75']
+
+
+def fixture_bids(nb_rows=6000, seed=420):
+    """
+    Time ordered bids of a few bidders, the first one with enough bids to switch its interval sketch
+    from exact values to buckets, the others with a handful of bids
+    """
+    random = np.random.RandomState(seed)
+    bidders = np.where(random.rand(nb_rows) < 0.5, 'robot', np.array(['b{}'.format(i) for i in range(40)])[
+        random.randint(40, size=nb_rows)])
+    return pd.DataFrame({
+        'bidder_id': bidders,
+        'auction': np.array(['u{}'.format(i) for i in range(30)])[random.randint(30, size=nb_rows)],
+        'merchandise': np.array(['books', 'mobile', 'jewelry'])[random.randint(3, size=nb_rows)],
+        'device': np.array(['d{}'.format(i) for i in range(8)])[random.randint(8, size=nb_rows)],
+        'time': np.cumsum(random.geometric(0.01, size=nb_rows) - 1).astype(np.int64),
+        'country': np.array(['fr', 'us', 'in', 'id'])[random.randint(4, size=nb_rows)],
+        'ip': np.array(['ip{}'.format(i) for i in range(500)])[random.randint(500, size=nb_rows)],
+        'url': np.array(['w{}'.format(i) for i in range(200)])[random.randint(200, size=nb_rows)],
+    })
+
+
+def test_two_halves_match_the_engine(tmp_path):
+    bids = fixture_bids()
+    half = len(bids) // 2
+    summaries = IncrementalFeatures(str(tmp_path))
+    summaries.fold(bids.iloc[:half], 'first.csv', 'first')
+    summaries.fold(bids.iloc[half:], 'second.csv', 'second')
+
+    engine_ids, engine_rows = FeatureEngine.from_frame(bids).compute()
+    engine_data = pd.DataFrame(engine_rows, index=engine_ids, columns=COLUMN_NAMES)
+    folded_data = pd.DataFrame(summaries.features(engine_ids), index=engine_ids, columns=COLUMN_NAMES)
+    assert summaries.bidder_ids() == list(engine_ids)
+
+    sketch = QuantileSketch()
+    relative_accuracy = (sketch.gamma - 1) / (sketch.gamma + 1)
+    sketched = (engine_data['bid_nb'] - 1 > sketch.max_exact).values
+    assert sketched.any() and not sketched.all()
+    for column in COLUMN_NAMES:
+        if column.startswith('arg_max'):
+            assert folded_data[column].tolist() == engine_data[column].tolist(), column
+        elif column in PERCENTILE_COLUMNS:
+            assert np.allclose(folded_data[column].values[~sketched], engine_data[column].values[~sketched],
+                               rtol=1e-9), column
+            assert np.allclose(folded_data[column].values[sketched], engine_data[column].values[sketched],
+                               rtol=relative_accuracy, atol=0), column
+        else:
+            assert np.allclose(folded_data[column].values, engine_data[column].values, rtol=1e-9), column
+
+
+def test_folding_the_same_content_twice_raises(tmp_path):
+    bids = fixture_bids(100)
+    summaries = IncrementalFeatures(str(tmp_path))
+    summaries.fold(bids, 'bids.csv', 'hash')
+    with pytest.raises(ValueError):
+        summaries.fold(bids, 'copy.csv', 'hash')
+    assert summaries.paths == ['bids.csv']
@@ -0,0 +1,68 @@
+"""
+FeatureTransform against PCA followed by PolynomialFeatures(2), the layout saved bundles rely on
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import PolynomialFeatures
+
+from src.feature_spec import FeatureSpec
+from src.transform import FeatureTransform
+
+
+def fixture_data(nb_rows=50, nb_columns=6, seed=420):
+    """
+    Sparse rows with about half of the values set
+    """
+    random = np.random.RandomState(seed)
+    values = random.normal(size=(nb_rows, nb_columns)) * (random.rand(nb_rows, nb_columns) < 0.5)
+    return sparse.csr_matrix(values)
+
+
+def reference_transform(spec, data):
+    """
+    The former feature engineering: PCA components added as columns, columns put in spec order,
+    then PolynomialFeatures(2), in float64
+    """
+    dense = data.toarray()
+    projection = PCA(n_components=len(spec.pca_features), svd_solver='full').fit_transform(dense)
+    frame = pd.DataFrame(dense, columns=spec.data_features)
+    for i, feature in enumerate(spec.pca_features):
+        frame[feature] = projection[:, i]
+    return PolynomialFeatures(2).fit_transform(np.nan_to_num(frame[spec.features].values))
+
+
+@pytest.mark.parametrize('features', [
+    ['f0', 'f1', 'f2', 'f3', 'f4', 'f5', 'pca_1', 'pca_2'],
+    ['pca_1', 'f3', 'f0', 'pca_2', 'f5', 'f1', 'f4', 'f2'],
+    ['f2', 'pca_2', 'f0', 'f1', 'pca_1', 'f5', 'f3', 'f4'],
+])
+def test_transform_equals_pca_and_polynomial_features(features):
+    spec = FeatureSpec(features)
+    data = fixture_data()
+    transform = FeatureTransform(spec, batch_size=16).fit(data)
+    expected = reference_transform(spec, data)
+
+    # The sign of a principal axis is arbitrary: align each component on the reference one
+    reference_pca = PCA(n_components=len(spec.pca_features), svd_solver='full').fit(data.toarray())
+    signs = np.sign(np.sum(reference_pca.components_ * transform.pca.components_, axis=1))
+    assert np.all(signs != 0)
+    transform.components *= signs
+    transform.projected_mean *= signs
+
+    output = transform.transform(data)
+    assert output.dtype == np.float32
+    assert output.shape == (data.shape[0], transform.n_outputs) == expected.shape
+    assert np.allclose(output, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_preallocated_output_is_filled_in_place():
+    spec = FeatureSpec(['f0', 'pca_1', 'f1', 'f2', 'f3', 'f4', 'f5'])
+    data = fixture_data()
+    transform = FeatureTransform(spec, batch_size=7).fit(data)
+    out = np.full((data.shape[0], transform.n_outputs), np.nan, dtype=np.float32)
+    assert transform.transform(data, out=out) is out
+    expected = FeatureTransform(spec, batch_size=data.shape[0]).fit(data).transform(data)
+    assert np.allclose(out, expected, rtol=1e-6, atol=1e-7)